@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+from index_manifest import current_index_version
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))  # max cached answers per worker
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # min cosine similarity to reuse
+
+
+class SemanticAnswerCache:
+    """
+    Caches full RAG answers keyed by query embedding. A new query reuses a stored answer when its
+    cosine similarity to the cached query is at least `threshold`, the same highlighted text was
+    sent, and retrieval returned exactly the same chunk IDs. Because chunk IDs are content hashes,
+    edited chunks never match; the whole cache is also dropped whenever the index version changes.
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = []
+        self._matrix = None  # stacked unit vectors of self._entries, rebuilt lazily
+        self._index_version = current_index_version()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        if vector is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _check_index_version(self):
+        version = current_index_version()
+        if version != self._index_version:
+            self._entries.clear()
+            self._matrix = None
+            self._index_version = version
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def lookup(self, vector, chunk_ids, selected_text: str | None):
+        """Returns a cached answer for a near-duplicate query with the same retrieval result, or None."""
+        unit = self._unit(vector)
+        with self._lock:
+            self._check_index_version()
+            if unit is None or not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix = np.vstack([entry["vector"] for entry in self._entries])
+            similarities = self._matrix @ unit
+            chunk_ids = frozenset(chunk_ids)
+            for i in np.argsort(-similarities):
+                if similarities[i] < self.threshold:
+                    break
+                entry = self._entries[i]
+                if entry["chunk_ids"] == chunk_ids and entry["selected_text"] == selected_text:
+                    entry["hits"] += 1
+                    entry["last_used"] = time.monotonic()
+                    self.hits += 1
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, query: str, vector, chunk_ids, selected_text: str | None, answer: str):
+        """Caches a model-generated answer, evicting the least recently used entry when full."""
+        unit = self._unit(vector)
+        if unit is None or not answer:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._check_index_version()
+            if len(self._entries) >= self.max_entries:
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                self._entries.pop(oldest)
+            self._entries.append({
+                "query": query,
+                "vector": unit,
+                "chunk_ids": frozenset(chunk_ids),
+                "selected_text": selected_text,
+                "answer": answer,
+                "hits": 0,
+                "created_at": time.time(),
+                "last_used": now,
+            })
+            self._matrix = None
+
+    def stats(self, top: int = 10) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            popular = sorted(self._entries, key=lambda entry: entry["hits"], reverse=True)[:top]
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "index_version": self._index_version,
+                "top_entries": [
+                    {"query": entry["query"], "hits": entry["hits"], "created_at": entry["created_at"]}
+                    for entry in popular
+                ],
+            }
@@ -1,9 +1,29 @@
-from sqlalchemy import create_engine, Column, Integer, String
+import os
+import hmac
+import asyncio
+import json
+import time
+import base64
+import hashlib
+import logging
+import secrets
+
+from sqlalchemy import Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from passlib.context import CryptContext
 
-DATABASE_URL = "sqlite:///./test.db"
+from database import engine
+from password_hashing import check_password, hash_password
+
+logger = logging.getLogger(__name__)
+
+# Session tokens are signed with this key; set it to the same value on every worker so tokens
+# survive restarts and work across workers.
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+SESSION_TTL_S = int(os.getenv("SESSION_TTL_S", str(7 * 24 * 3600)))
+
+if not SESSION_SECRET:
+    logger.warning("SESSION_SECRET is not set; using a random key, so sessions end when this worker restarts.")
+    SESSION_SECRET = secrets.token_urlsafe(32)
 
 Base = declarative_base()
 
@@ -15,34 +35,62 @@ class User(Base):
     hashed_password = Column(String)
     background = Column(String)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base.metadata.create_all(bind=engine)
+def init_db():
+    """Creates missing tables. Called on app startup rather than on import."""
+    Base.metadata.create_all(bind=engine)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# The query and commit below are blocking SQLAlchemy calls; the async helpers run them in a thread
+# so a locked SQLite write (up to SQLITE_BUSY_TIMEOUT_MS) never stalls the event loop.
 
-def get_password_hash(password):
-    # Truncate password to 72 bytes, as bcrypt has a limitation for longer passwords.
-    # It's important to note this limitation and potentially inform the user on the frontend.
-    truncated_password = password.encode('utf-8')[:72].decode('utf-8', 'ignore')
-    return pwd_context.hash(truncated_password)
+def get_user_by_email(db, email):
+    return db.query(User).filter(User.email == email).first()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def _save_user(db, db_user):
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
 
-def authenticate_user(db, email, password):
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(db, email, password):
+    user = await asyncio.to_thread(get_user_by_email, db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await check_password(password, user.hashed_password):
         return None
     return user
 
-def create_user(db, email, password, background):
-    hashed_password = get_password_hash(password)
+async def create_user(db, email, password, background):
+    hashed_password = await hash_password(password)
     db_user = User(email=email, hashed_password=hashed_password, background=background)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await asyncio.to_thread(_save_user, db, db_user)
+
+# --- Session tokens ---
+# `<payload>.<signature>`, both base64url: the payload is the user's claims and an expiry, the
+# signature an HMAC-SHA256 of the payload. Checking one costs microseconds instead of a bcrypt check.
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+def _sign(payload: bytes) -> bytes:
+    return _b64encode(hmac.new(SESSION_SECRET.encode("utf-8"), payload, hashlib.sha256).digest()).encode("ascii")
+
+def create_session_token(user, ttl_s: int = SESSION_TTL_S) -> str:
+    claims = {"sub": user.id, "email": user.email, "background": user.background, "exp": int(time.time()) + ttl_s}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8")).encode("ascii")
+    return f"{payload.decode('ascii')}.{_sign(payload).decode('ascii')}"
+
+def verify_session_token(token: str) -> dict | None:
+    """Returns the token's claims, or None if it is malformed, tampered with or expired."""
+    try:
+        payload, _, signature = token.encode("utf-8").partition(b".")
+        if not payload or not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):  # bad encoding, base64 or JSON (UnicodeError and JSONDecodeError are ValueErrors)
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get("exp"), (int, float)) or claims["exp"] < time.time():
+        return None
+    return claims
@@ -0,0 +1,347 @@
+"""
+Offline benchmark for the RAG backend's hot paths.
+
+Gemini is replaced by deterministic fakes with configurable latency (see fakes.py), and Qdrant
+runs in `:memory:` mode, so no API keys or servers are needed. The script measures:
+
+* indexing throughput of `index_book.main` and `ingest.ingest_markdown_files` (chunks/s)
+* latency percentiles and throughput of `/search` and `/search/stream` (plus time to first
+  byte for the stream) under concurrent load, against either retrieval backend (`--backend`)
+
+Results are written as JSON; pass `--baseline` with an earlier result to compare runs.
+
+    python benchmark.py --requests 500 --concurrency 50 --output bench_results/latest.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+QUESTIONS = [
+    "What is embodied intelligence?",
+    "How do ROS 2 nodes communicate over topics?",
+    "What is the difference between a ROS 2 service and an action?",
+    "How do I describe a robot with URDF?",
+    "How does Gazebo simulate sensors?",
+    "What is NVIDIA Isaac Sim used for?",
+    "How does Nav2 plan a path?",
+    "How does a RealSense camera measure depth?",
+    "What is a vision-language-action model?",
+    "How can Whisper turn voice commands into robot actions?",
+    "How do I deploy a model on a Jetson Orin?",
+    "How do I control a Unitree humanoid?",
+    "How do the capstone project components fit together?",
+    "How should the final robot demonstration be prepared?",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low, high = int(rank), min(int(rank) + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies, errors, elapsed_s, first_byte_latencies=None):
+    ms = [latency * 1000 for latency in latencies]
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed_s if elapsed_s else None,
+        "mean_ms": statistics.fmean(ms) if ms else None,
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+    }
+    if first_byte_latencies:
+        ttfb = [latency * 1000 for latency in first_byte_latencies]
+        summary.update(ttfb_p50_ms=percentile(ttfb, 50), ttfb_p95_ms=percentile(ttfb, 95), ttfb_p99_ms=percentile(ttfb, 99))
+    return summary
+
+
+def configure_environment(workdir: str, backend: str):
+    """Points every on-disk artifact at a scratch directory and fakes credentials. Must run before imports."""
+    build_dir = os.path.join(workdir, "build")
+    os.makedirs(build_dir, exist_ok=True)
+    with open(os.path.join(build_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write("<!doctype html><title>benchmark</title>")
+    os.environ.update({
+        "GEMINI_API_KEY": "benchmark",
+        "QDRANT_URL": "http://benchmark.invalid",
+        "QDRANT_API_KEY": "benchmark",
+        "RETRIEVAL_BACKEND": backend,
+        "FRONTEND_BUILD_DIR": build_dir,
+        "INDEX_MANIFEST_PATH": os.path.join(workdir, "manifest.json"),
+        "FAILED_BATCHES_PATH": os.path.join(workdir, "failed_embeddings.json"),
+        "KEYWORD_INDEX_PATH": os.path.join(workdir, "keyword_index.json"),
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "local_index"),
+        "EMBEDDING_CACHE_DB": os.path.join(workdir, "embedding_cache.db"),
+        "INDEX_METRICS_PATH": os.path.join(workdir, "index_metrics.prom"),
+        "PARSE_CACHE_DIR": os.path.join(workdir, "parse_cache"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+    })
+
+
+# --- Indexing ---
+def bench_index_book():
+    import index_book
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(":memory:")
+    index_book.QdrantClient = lambda *args, **kwargs: client
+    start = time.perf_counter()
+    index_book.main(full=True)
+    elapsed = time.perf_counter() - start
+    chunks = client.count(index_book.QDRANT_COLLECTION_NAME).count
+    return {"chunks": chunks, "seconds": elapsed, "chunks_per_s": chunks / elapsed if elapsed else None}
+
+
+def bench_ingest():
+    try:
+        import ingest
+        import qdrant_utils
+    except ImportError as e:
+        return {"skipped": f"missing dependency: {e}"}
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(":memory:")
+    qdrant_utils.qdrant_manager.client = client
+    start = time.perf_counter()
+    try:
+        ingest.ingest_markdown_files(os.path.join(os.path.dirname(__file__), "..", "..", "docs"))
+    except Exception as e:
+        return {"error": repr(e)}
+    elapsed = time.perf_counter() - start
+    chunks = client.count(qdrant_utils.COLLECTION_NAME).count
+    return {"chunks": chunks, "seconds": elapsed, "chunks_per_s": chunks / elapsed if elapsed else None}
+
+
+# --- Serving ---
+async def load_qdrant_memory_backend(main):
+    """Copies the vectors written by index_book into an in-memory AsyncQdrantClient for main.py."""
+    from qdrant_client import AsyncQdrantClient, models
+    from config import point_vector, vectors_config
+    from local_index import LocalVectorIndex
+    from retrievers import QdrantRetriever
+
+    index = LocalVectorIndex.load()
+    client = AsyncQdrantClient(":memory:")
+    await client.create_collection(main.QDRANT_COLLECTION_NAME, vectors_config=vectors_config())
+    points = []
+    for row in range(len(index)):
+        record = index._record(row)
+        points.append(models.PointStruct(id=record["id"], vector=point_vector(index.vectors[row].tolist()), payload=record["payload"]))
+    await client.upsert(main.QDRANT_COLLECTION_NAME, points=points, wait=True)
+    main.retriever = QdrantRetriever(client, main.QDRANT_COLLECTION_NAME)
+
+
+async def run_load(client, path, queries, concurrency, stream=False):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_bytes, errors = [], [], 0
+
+    async def one(query):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if stream:
+                    async with client.stream("POST", path, json={"query": query}) as response:
+                        first = None
+                        async for _ in response.aiter_bytes():
+                            if first is None:
+                                first = time.perf_counter() - start
+                        ok = response.status_code == 200
+                else:
+                    response = await client.post(path, json={"query": query})
+                    ok = response.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+                if stream:
+                    first_bytes.append(first)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(query) for query in queries))
+    return summarize(latencies, errors, time.perf_counter() - start, first_bytes)
+
+
+def make_queries(args, variant: str):
+    """
+    Builds the query list for one endpoint run. Each run gets its own query strings so answers
+    cached by an earlier run are not reused; --distinct-queries controls repeats within a run.
+    """
+    distinct = args.distinct_queries or args.requests
+    return [f"{QUESTIONS[i % len(QUESTIONS)]} ({variant}{i % distinct})" for i in range(args.requests)]
+
+
+def start_server(app):
+    """Serves `app` with uvicorn on a free localhost port in a background thread."""
+    import socket
+    import threading
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+async def drive_endpoints(base_url, args):
+    import httpx
+
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        # Warm up lazy state (event-loop bound objects, first-call imports) outside the measurement.
+        await client.post("/search", json={"query": "warm up"})
+        results["/search"] = await run_load(client, "/search", make_queries(args, "a"), args.concurrency)
+        results["/search/stream"] = await run_load(
+            client, "/search/stream", make_queries(args, "b"), args.concurrency, stream=True
+        )
+    return results
+
+
+def bench_endpoints(args):
+    """Runs the app under uvicorn on a real socket, so streaming time-to-first-byte is measurable."""
+    import main
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if main.RETRIEVAL_BACKEND == "qdrant":
+        asyncio.run(load_qdrant_memory_backend(main))
+
+    server, thread, base_url = start_server(main.app)
+    try:
+        results = asyncio.run(drive_endpoints(base_url, args))
+    finally:
+        server.should_exit = True
+        thread.join()
+    results["stats"] = main.stats()
+    return results
+
+
+# --- Reporting ---
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline, path=(), skip=()):
+    """Yields (metric path, baseline, current, relative change) for every numeric metric in both runs."""
+    for key, value in current.items():
+        if key not in baseline or key in skip:
+            continue
+        if isinstance(value, dict) and isinstance(baseline[key], dict):
+            yield from compare(value, baseline[key], path + (key,), skip)
+        elif isinstance(value, (int, float)) and isinstance(baseline[key], (int, float)) and baseline[key]:
+            yield "/".join(path + (key,)), baseline[key], value, (value - baseline[key]) / baseline[key]
+
+
+def is_regression(metric: str, change: float, threshold: float) -> bool:
+    if metric.endswith("_ms"):
+        return change > threshold
+    if metric.endswith(("_rps", "_per_s")):
+        return change < -threshold
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG backend with local stand-ins for Gemini and Qdrant.")
+    parser.add_argument("--backend", choices=["qdrant", "local"], default="qdrant",
+                        help="Retrieval backend for the endpoint benchmark (qdrant runs in :memory: mode).")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint.")
+    parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight at once.")
+    parser.add_argument("--distinct-queries", type=int, default=0,
+                        help="Number of distinct query strings (default: all unique, so caches only help repeats you ask for).")
+    parser.add_argument("--embed-latency-ms", type=float, default=50.0, help="Fake embedding latency per call.")
+    parser.add_argument("--generate-latency-ms", type=float, default=500.0, help="Fake generation latency per answer.")
+    parser.add_argument("--skip-indexing", action="store_true", help="Skip the ingest.py indexing benchmark.")
+    parser.add_argument("--output", default=None, help="Where to write the JSON results (default: bench_results/<timestamp>.json).")
+    parser.add_argument("--baseline", default=None, help="Earlier results JSON to compare against.")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="Exit non-zero if any latency/throughput metric is worse than the baseline by more than this fraction (e.g. 0.2).")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    configure_environment(workdir, args.backend)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import fakes
+    embedder = fakes.FakeEmbedder(latency_ms=args.embed_latency_ms)
+    generator = fakes.FakeGenerator(latency_ms=args.generate_latency_ms)
+    fakes.install(embedder, generator)
+
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "indexing": {"index_book": bench_index_book()},
+    }
+    if not args.skip_indexing:
+        results["indexing"]["ingest"] = bench_ingest()
+    results["endpoints"] = bench_endpoints(args)
+    results["fake_api_calls"] = {"embed_calls": embedder.calls, "embedded_texts": embedder.texts, "generate_calls": generator.calls}
+
+    output = args.output or os.path.join("bench_results", f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print("\n=== Benchmark results ===")
+    for name, summary in results["indexing"].items():
+        print(f"indexing {name:<12} {summary}")
+    for endpoint in ("/search", "/search/stream"):
+        summary = results["endpoints"][endpoint]
+        line = f"{endpoint:<22} p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms p99={summary['p99_ms']:.1f}ms " \
+               f"rps={summary['throughput_rps']:.1f} errors={summary['errors']}"
+        if "ttfb_p50_ms" in summary:
+            line += f" ttfb_p50={summary['ttfb_p50_ms']:.1f}ms"
+        print(line)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = []
+        print(f"\n=== Compared with {args.baseline} ===")
+        for metric, before, after, change in compare(
+            {"indexing": results["indexing"], "endpoints": results["endpoints"]},
+            {"indexing": baseline.get("indexing", {}), "endpoints": baseline.get("endpoints", {})},
+            skip=("stats",),
+        ):
+            if not metric.endswith(("_ms", "_rps", "_per_s")):
+                continue
+            flag = ""
+            if args.max_regression is not None and is_regression(metric, change, args.max_regression):
+                regressions.append(metric)
+                flag = "  <-- REGRESSION"
+            print(f"{metric:<45} {before:>10.2f} -> {after:>10.2f} ({change:+.1%}){flag}")
+        if regressions:
+            print(f"\n{len(regressions)} metrics regressed by more than {args.max_regression:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
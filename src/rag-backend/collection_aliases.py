@@ -0,0 +1,125 @@
+import argparse
+from datetime import datetime, timezone
+
+from qdrant_client import models
+
+# How many previous collection versions to keep around for `rollback` after switching the alias.
+COLLECTION_VERSIONS_TO_KEEP = 2
+
+
+def version_prefix(alias: str) -> str:
+    return f"{alias}_v"
+
+
+def list_versions(client, alias: str) -> list[str]:
+    """Returns the versioned collections behind `alias`, oldest first."""
+    prefix = version_prefix(alias)
+    names = [c.name for c in client.get_collections().collections if c.name.startswith(prefix)]
+    return sorted(names)
+
+
+def alias_target(client, alias: str):
+    """Returns the collection `alias` points to, or None if there is no such alias."""
+    for description in client.get_aliases().aliases:
+        if description.alias_name == alias:
+            return description.collection_name
+    return None
+
+
+def is_legacy_collection(client, alias: str) -> bool:
+    """True if `alias` is still a plain collection from before versioned collections were used."""
+    return any(c.name == alias for c in client.get_collections().collections)
+
+
+def resolve_collection(client, alias: str):
+    """Returns the collection currently served under `alias` (a version, a legacy collection or None)."""
+    target = alias_target(client, alias)
+    if target is None and is_legacy_collection(client, alias):
+        return alias
+    return target
+
+
+def pending_version(client, alias: str):
+    """Returns the newest version built after the live one but never published, or None."""
+    target = alias_target(client, alias)
+    newer = [name for name in list_versions(client, alias) if target is None or name > target]
+    return newer[-1] if newer else None
+
+
+def create_version(client, alias: str, vectors_config) -> str:
+    """Creates a new, empty versioned collection for `alias` and returns its name."""
+    name = f"{version_prefix(alias)}{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')}"
+    client.create_collection(collection_name=name, vectors_config=vectors_config)
+    return name
+
+
+def verify_point_count(client, collection_name: str, expected: int):
+    """Raises RuntimeError unless `collection_name` holds exactly `expected` (> 0) points."""
+    count = client.count(collection_name=collection_name, exact=True).count
+    if expected <= 0 or count != expected:
+        raise RuntimeError(f"Collection '{collection_name}' has {count} points, expected {expected}.")
+
+
+def switch_alias(client, alias: str, collection_name: str):
+    """
+    Atomically points `alias` at `collection_name`. A legacy collection named `alias` has to be
+    dropped first, since an alias cannot shadow a collection; that one-time migration is the
+    only moment the alias does not resolve.
+    """
+    operations = []
+    if alias_target(client, alias) is not None:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    elif is_legacy_collection(client, alias):
+        print(f"Migrating legacy collection '{alias}' to an alias; dropping the old collection.")
+        client.delete_collection(collection_name=alias)
+    operations.append(models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias)
+    ))
+    client.update_collection_aliases(change_aliases_operations=operations)
+
+
+def prune_versions(client, alias: str, keep: int = COLLECTION_VERSIONS_TO_KEEP):
+    """Deletes all but the live version and the `keep` newest versions before it."""
+    target = alias_target(client, alias)
+    versions = list_versions(client, alias)
+    older = [name for name in versions if target is None or name < target]
+    for name in older[:max(len(older) - keep, 0)]:
+        client.delete_collection(collection_name=name)
+        print(f"Deleted old collection version '{name}'.")
+
+
+def publish_version(client, alias: str, collection_name: str, expected_points: int, keep: int = COLLECTION_VERSIONS_TO_KEEP):
+    """Verifies a freshly built version, switches `alias` to it, and prunes old versions."""
+    verify_point_count(client, collection_name, expected_points)
+    switch_alias(client, alias, collection_name)
+    print(f"Alias '{alias}' now points to '{collection_name}'.")
+    prune_versions(client, alias, keep)
+
+
+def rollback(client, alias: str) -> str:
+    """Points `alias` back at the newest version older than the live one and returns its name."""
+    target = alias_target(client, alias)
+    previous = [name for name in list_versions(client, alias) if target is None or name < target]
+    if not previous:
+        raise RuntimeError(f"No previous version of '{alias}' to roll back to.")
+    switch_alias(client, alias, previous[-1])
+    return previous[-1]
+
+
+if __name__ == "__main__":
+    import os
+    from dotenv import load_dotenv
+    from qdrant_client import QdrantClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Inspect or roll back the versioned collections behind an alias.")
+    parser.add_argument("--alias", default="ai_book")
+    parser.add_argument("--rollback", action="store_true", help="Point the alias at the previous version.")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    if args.rollback:
+        print(f"Alias '{args.alias}' now points to '{rollback(client, args.alias)}'.")
+    target = alias_target(client, args.alias)
+    for name in list_versions(client, args.alias):
+        print(f"{'*' if name == target else ' '} {name}")
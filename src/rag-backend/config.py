@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+from qdrant_client import models
+
+# --- Embeddings ---
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIM = 768  # output size of text-embedding-004
+
+# Optional compact vectors for the first search pass (0 = off). text-embedding-004 supports
+# `output_dimensionality`, which keeps the leading dimensions; truncating and re-normalizing the
+# full vector gives the same result without a second embedding call. Changing this (or the
+# quantization) needs a full re-index: `python index_book.py --full`.
+COMPACT_EMBEDDING_DIM = int(os.getenv("COMPACT_EMBEDDING_DIM", "0"))
+# Quantization of the first-pass vectors: "none", "scalar" (int8) or "binary" (1 bit per dimension).
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+# The first pass fetches limit * RESCORE_OVERSAMPLING candidates, which are then rescored with full vectors.
+RESCORE_OVERSAMPLING = float(os.getenv("RESCORE_OVERSAMPLING", "4"))
+
+# Named vectors used when COMPACT_EMBEDDING_DIM is set; otherwise points have a single unnamed vector.
+FULL_VECTOR = "full"
+COMPACT_VECTOR = "compact"
+
+if VECTOR_QUANTIZATION not in ("none", "scalar", "binary"):
+    raise ValueError(f"VECTOR_QUANTIZATION must be 'none', 'scalar' or 'binary', not '{VECTOR_QUANTIZATION}'.")
+if not 0 <= COMPACT_EMBEDDING_DIM < EMBEDDING_DIM:
+    raise ValueError(f"COMPACT_EMBEDDING_DIM must be between 0 and {EMBEDDING_DIM - 1}.")
+
+TWO_STAGE_SEARCH = bool(COMPACT_EMBEDDING_DIM) or VECTOR_QUANTIZATION != "none"
+
+
+def vector_settings() -> dict:
+    """The settings a collection or local index was built with; stored in the manifest to detect changes."""
+    return {
+        "dim": EMBEDDING_DIM,
+        "compact_dim": COMPACT_EMBEDDING_DIM,
+        "quantization": VECTOR_QUANTIZATION,
+    }
+
+
+def compact_vector(vector, dim: int = COMPACT_EMBEDDING_DIM) -> list[float]:
+    """Truncates a full embedding to its first `dim` dimensions and re-normalizes it."""
+    truncated = np.asarray(vector, dtype=np.float32)[:dim]
+    norm = np.linalg.norm(truncated)
+    return (truncated / norm if norm else truncated).tolist()
+
+
+def point_vector(vector):
+    """The vector (or named vectors) to store for a point with this full embedding."""
+    if not COMPACT_EMBEDDING_DIM:
+        return vector
+    return {FULL_VECTOR: vector, COMPACT_VECTOR: compact_vector(vector)}
+
+
+def full_vector(vector):
+    """The full embedding from a stored point's vector (or named vectors)."""
+    if isinstance(vector, dict):
+        return vector.get(FULL_VECTOR)
+    return vector
+
+
+def quantization_config():
+    if VECTOR_QUANTIZATION == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if VECTOR_QUANTIZATION == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def vectors_config():
+    """
+    Qdrant vectors config for a new collection. With compact vectors, the full vectors are kept
+    on disk for rescoring and only the (optionally quantized) compact ones are searched in RAM.
+    """
+    if not COMPACT_EMBEDDING_DIM:
+        return models.VectorParams(
+            size=EMBEDDING_DIM, distance=models.Distance.COSINE, quantization_config=quantization_config()
+        )
+    return {
+        FULL_VECTOR: models.VectorParams(size=EMBEDDING_DIM, distance=models.Distance.COSINE, on_disk=True),
+        COMPACT_VECTOR: models.VectorParams(
+            size=COMPACT_EMBEDDING_DIM, distance=models.Distance.COSINE, quantization_config=quantization_config()
+        ),
+    }
@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+
+from keyword_index import tokenize
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))  # estimated prompt tokens for retrieved text
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "8"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))  # 1.0 = pure relevance, 0.0 = pure diversity
+MAX_OVERLAP_CHARS = 200  # longest repeated span looked for between neighbouring chunks (index_book overlaps by 100)
+MIN_OVERLAP_CHARS = 20
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return (len(text) + 3) // 4
+
+
+def strip_overlap(previous: str, text: str) -> str:
+    """Removes the start of `text` that repeats the end of `previous` (the splitter's chunk overlap)."""
+    for size in range(min(len(previous), len(text), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+
+def _content(hit) -> str:
+    return (hit.payload or {}).get("page_content", "")
+
+
+def _vector(hit):
+    vector = getattr(hit, "vector", None)
+    if vector is None or isinstance(vector, dict):
+        return None
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def _similarity(a, b) -> float:
+    """Cosine similarity of the hits' vectors, or token Jaccard similarity if either has none."""
+    if a["vector"] is not None and b["vector"] is not None:
+        return float(a["vector"] @ b["vector"])
+    union = a["tokens"] | b["tokens"]
+    return len(a["tokens"] & b["tokens"]) / len(union) if union else 0.0
+
+
+def mmr_order(hits, mmr_lambda: float = MMR_LAMBDA):
+    """
+    Reorders hits by maximal marginal relevance: each pick maximizes
+    lambda * relevance - (1 - lambda) * max similarity to the hits already picked.
+    Relevance is the hit's score scaled to [0, 1] (scores from Qdrant, BM25 and RRF are not comparable).
+    """
+    if not hits:
+        return []
+    scores = [hit.score for hit in hits]
+    low, high = min(scores), max(scores)
+    candidates = [
+        {
+            "hit": hit,
+            "relevance": (hit.score - low) / (high - low) if high > low else 1.0,
+            "vector": _vector(hit),
+            "tokens": set(tokenize(_content(hit))),
+        }
+        for hit in hits
+    ]
+    ordered = []
+    while candidates:
+        best = max(
+            candidates,
+            key=lambda c: mmr_lambda * c["relevance"]
+            - (1 - mmr_lambda) * max((_similarity(c, o) for o in ordered), default=0.0),
+        )
+        candidates.remove(best)
+        ordered.append(best)
+    return [c["hit"] for c in ordered]
+
+
+def pack_context(
+    hits,
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    max_chunks: int = CONTEXT_MAX_CHUNKS,
+    mmr_lambda: float = MMR_LAMBDA,
+):
+    """
+    Picks retrieved chunks for the prompt and returns (selected hits, passages).
+
+    Candidates are deduplicated, ordered by MMR and added while they fit `token_budget`
+    (a chunk's cost excludes the overlap it shares with an already selected neighbour).
+    Selected chunks that are adjacent in the same source are merged into one passage with the
+    overlap removed. Passages are ordered by their best-ranked chunk.
+    """
+    seen = set()
+    unique = []
+    for hit in hits:
+        text = _content(hit)
+        key = (hit.payload or {}).get("content_hash") or text
+        if text and key not in seen:
+            seen.add(key)
+            unique.append(hit)
+
+    positions = {}  # (source, chunk_index) -> selected chunk, for neighbour lookups
+    selected = []  # [{"hit", "text", "source", "index", "rank"}] in MMR order
+    used = 0
+    for hit in mmr_order(unique, mmr_lambda):
+        if len(selected) >= max_chunks:
+            break
+        text = _content(hit)
+        source, index = hit.payload.get("source"), hit.payload.get("chunk_index")
+        cost = estimate_tokens(text)
+        if index is not None:
+            previous, following = positions.get((source, index - 1)), positions.get((source, index + 1))
+            if previous is not None:
+                cost = estimate_tokens(strip_overlap(previous["text"], text))
+            if following is not None:
+                cost -= estimate_tokens(following["text"]) - estimate_tokens(strip_overlap(text, following["text"]))
+        if used + cost > token_budget:
+            if selected:
+                continue
+            # Always keep the best chunk, trimmed to the budget.
+            text, cost = text[:token_budget * 4], token_budget
+        chunk = {"hit": hit, "text": text, "source": source, "index": index, "rank": len(selected)}
+        selected.append(chunk)
+        if index is not None:
+            positions[(source, index)] = chunk
+        used += cost
+
+    passages = []  # [(best rank, text)]
+    run = None
+    for chunk in sorted(selected, key=lambda c: (str(c["source"]), c["index"] is None, c["index"] or 0, c["rank"])):
+        if (
+            run is not None and chunk["index"] is not None and run["index"] is not None
+            and chunk["source"] == run["source"] and chunk["index"] == run["index"] + 1
+        ):
+            run["text"] += "\n" + strip_overlap(run["text"], chunk["text"])
+            run["rank"] = min(run["rank"], chunk["rank"])
+            run["index"] = chunk["index"]
+            continue
+        if run is not None:
+            passages.append((run["rank"], run["text"]))
+        run = dict(chunk)
+    if run is not None:
+        passages.append((run["rank"], run["text"]))
+    passages.sort(key=lambda passage: passage[0])
+    return [chunk["hit"] for chunk in selected], [text for _, text in passages]
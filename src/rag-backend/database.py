@@ -1,14 +1,46 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "sqlite:///./test.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # connections kept open per worker
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # extra connections allowed during bursts
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "5"))  # max wait for a free connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))  # wait for a writer's lock instead of failing
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# The one engine for the app: auth.py and the request dependency below share its pool.
+engine = create_engine(
+    DATABASE_URL,
+    # FastAPI hands sessions between threads, so SQLite connections must not be pinned to one.
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_S,
+    pool_pre_ping=not IS_SQLITE,
+)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def configure_sqlite(dbapi_connection, connection_record):
+        """WAL lets readers run alongside a writer; synchronous=NORMAL is safe with WAL and skips an fsync per commit."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
 
-engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def ping_database():
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
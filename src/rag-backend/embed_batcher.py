@@ -0,0 +1,114 @@
+import os
+import asyncio
+from collections import Counter
+
+import google.generativeai as genai
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))  # texts per batched embed call (API max 100)
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))  # how long the first text waits for company
+
+
+class QueryEmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embedding requests into one batched `embed_content_async` call.
+
+    The first request in an empty queue starts a timer of `max_wait_ms`; the batch is sent when the
+    timer fires or when `max_batch_size` texts are queued, whichever comes first. Identical texts in
+    the same batch are only embedded once. Each caller gets its own vector (or the batch's error).
+
+    With a `guard` (resilience.Guard), every upstream call goes through its circuit breaker and
+    deadline, so one batched call records one success or failure however many callers share it.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        task_type: str = "RETRIEVAL_QUERY",
+        max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+        max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS,
+        guard=None,
+    ):
+        self.model = model
+        self.guard = guard
+        self.task_type = task_type
+        self.max_batch_size = max(1, min(max_batch_size, 100))
+        self.max_wait_s = max_wait_ms / 1000
+        self._pending = []  # [(text, future)]
+        self._timer = None
+        self.batches = 0
+        self.requests = 0
+        self.failed_batches = 0
+        self.batch_sizes = Counter()  # batch size -> number of batches sent with that size
+        # embed_many calls bypass the queue, so they are counted apart and kept out of the fill stats.
+        self.direct_calls = 0
+        self.direct_texts = 0
+        self.failed_direct_calls = 0
+
+    async def embed(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_s, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._send(batch))
+
+    async def _embed_texts(self, texts):
+        def call():
+            return genai.embed_content_async(model=self.model, content=texts, task_type=self.task_type)
+
+        result = await (self.guard.call(call) if self.guard is not None else call())
+        return result["embedding"]
+
+    async def _send(self, batch):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        self.requests += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        try:
+            vectors = dict(zip(texts, await self._embed_texts(texts)))
+        except Exception as e:
+            self.failed_batches += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in batch:
+            # Callers that timed out have already cancelled their future.
+            if not future.done():
+                future.set_result(vectors[text])
+
+    async def embed_many(self, texts: list[str]) -> list[list[float]]:
+        """Embeds up to 100 texts in one call, bypassing the queue (for callers that already have a batch)."""
+        unique = list(dict.fromkeys(texts))
+        self.direct_calls += 1
+        self.direct_texts += len(texts)
+        try:
+            vectors = dict(zip(unique, await self._embed_texts(unique)))
+        except Exception:
+            self.failed_direct_calls += 1
+            raise
+        return [vectors[text] for text in texts]
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "failed_batches": self.failed_batches,
+            "mean_batch_fill": self.requests / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+            "direct_calls": self.direct_calls,
+            "direct_texts": self.direct_texts,
+            "failed_direct_calls": self.failed_direct_calls,
+        }
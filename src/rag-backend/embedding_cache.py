@@ -0,0 +1,148 @@
+import os
+import time
+import array
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Persistent tier lives next to test.db so cached query embeddings survive restarts.
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "./embedding_cache.db")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))  # in-process LRU entries
+EMBEDDING_CACHE_TTL_S = float(os.getenv("EMBEDDING_CACHE_TTL_S", "3600"))  # in-process entry lifetime
+EMBEDDING_CACHE_DISK_TTL_S = float(os.getenv("EMBEDDING_CACHE_DISK_TTL_S", str(30 * 24 * 3600)))
+EMBEDDING_CACHE_PRUNE_EVERY = int(os.getenv("EMBEDDING_CACHE_PRUNE_EVERY", "1000"))  # disk writes between expiry sweeps
+
+
+def normalize_query(text: str) -> str:
+    """Case-folds and collapses whitespace so trivially different spellings share a cache entry."""
+    return " ".join(text.casefold().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed on (model, normalized text): an in-process LRU with a
+    TTL in front of a SQLite table. Zero vectors (the embedding fallback) are never stored.
+
+    The two tiers have separate locks: SQLite reads and writes run in worker threads, and the LRU
+    is read on the event loop, so it must never wait behind a disk write. Expired rows are deleted
+    when read, and by a sweep on startup and every EMBEDDING_CACHE_PRUNE_EVERY writes.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        db_path: str = EMBEDDING_CACHE_DB,
+        max_entries: int = EMBEDDING_CACHE_SIZE,
+        ttl_s: float = EMBEDDING_CACHE_TTL_S,
+        disk_ttl_s: float = EMBEDDING_CACHE_DISK_TTL_S,
+    ):
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_ttl_s = disk_ttl_s
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (expires_at, vector)
+        self._memory_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._writes_since_prune = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+        self.prune()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    # --- In-process tier ---
+    def _memory_get(self, key: str):
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, vector = entry
+            if expires_at < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key: str, vector: list[float]):
+        with self._memory_lock:
+            self._memory[key] = (time.monotonic() + self.ttl_s, vector)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # --- SQLite tier ---
+    def _disk_get(self, key: str):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM query_embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] + self.disk_ttl_s < time.time():
+                with self._conn:
+                    self._conn.execute("DELETE FROM query_embeddings WHERE key = ?", (key,))
+                return None
+        if row is None:
+            return None
+        return array.array("f", row[0]).tolist()
+
+    def _disk_put(self, key: str, vector: list[float]):
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, model, vector, created_at) VALUES (?, ?, ?, ?)",
+                (key, self.model, array.array("f", vector).tobytes(), time.time()),
+            )
+            self._writes_since_prune += 1
+        if self._writes_since_prune >= EMBEDDING_CACHE_PRUNE_EVERY:
+            self.prune()
+
+    def prune(self) -> int:
+        """Deletes rows older than the disk TTL and returns how many were removed."""
+        with self._db_lock, self._conn:
+            self._writes_since_prune = 0
+            return self._conn.execute(
+                "DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.disk_ttl_s,)
+            ).rowcount
+
+    # --- Public API ---
+    async def get(self, text: str):
+        """Returns the cached embedding for `text`, or None on a miss."""
+        key = self._key(text)
+        vector = self._memory_get(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector
+        vector = await asyncio.to_thread(self._disk_get, key)
+        if vector is not None:
+            self.disk_hits += 1
+            self._memory_put(key, vector)
+            return vector
+        self.misses += 1
+        return None
+
+    async def put(self, text: str, vector: list[float]):
+        """Stores a freshly computed embedding in both tiers. Empty or all-zero vectors are ignored."""
+        if not vector or not any(vector):
+            return
+        key = self._key(text)
+        self._memory_put(key, vector)
+        await asyncio.to_thread(self._disk_put, key, vector)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
@@ -0,0 +1,207 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from metrics import EMBEDDING_RETRIES
+
+# Persistent record of batches that still failed after all retries, so a later run can resume them.
+FAILED_BATCHES_PATH = os.getenv(
+    "FAILED_BATCHES_PATH", os.path.join(os.path.dirname(__file__), ".failed_embeddings.json")
+)
+
+MAX_API_BATCH_SIZE = 100  # batchEmbedContents accepts at most 100 texts per request
+
+# Errors worth retrying: quota/rate limiting, server-side failures and timeouts.
+TRANSIENT_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    ConnectionError,
+    TimeoutError,
+)
+# InvalidArgument also covers bad API keys and model names; only errors whose message is about
+# the request's size mean the batch was too large, and those batches are split instead of failed.
+OVERSIZE_MESSAGE = re.compile(r"payload size|request size|too large|exceeds the (limit|maximum)|at most \d+", re.IGNORECASE)
+
+
+def is_oversize_error(error) -> bool:
+    return isinstance(error, google_exceptions.InvalidArgument) and OVERSIZE_MESSAGE.search(str(error)) is not None
+
+
+class EmbeddingPipeline:
+    """
+    Embeds (key, text) items with a bounded number of batches in flight.
+
+    Batch size adapts to the API: it is halved whenever a batch is rejected or throttled and
+    grows back slowly after consecutive successes. Transient errors are retried with exponential
+    backoff and full jitter. Batches that still fail are written to FAILED_BATCHES_PATH instead
+    of being silently dropped.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        task_type: str = "RETRIEVAL_DOCUMENT",
+        max_in_flight: int = 4,
+        batch_size: int = MAX_API_BATCH_SIZE,
+        min_batch_size: int = 1,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        failures_path: str = FAILED_BATCHES_PATH,
+    ):
+        self.model = model
+        self.task_type = task_type
+        self.max_in_flight = max_in_flight
+        self.max_batch_size = min(batch_size, MAX_API_BATCH_SIZE)
+        self.min_batch_size = min_batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures_path = failures_path
+        self.batch_size = self.max_batch_size
+        self._successes_since_resize = 0
+        self._lock = threading.Lock()
+
+    # --- Adaptive batch sizing ---
+    def _shrink(self):
+        with self._lock:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self._successes_since_resize = 0
+
+    def _grow(self):
+        with self._lock:
+            self._successes_since_resize += 1
+            if self._successes_since_resize >= self.max_in_flight and self.batch_size < self.max_batch_size:
+                self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 4))
+                self._successes_since_resize = 0
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    # --- Single batch with retries ---
+    def _embed_batch(self, batch):
+        """Embeds one batch, returning (vectors, None) on success or (None, error) on failure."""
+        texts = [text for _, text in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = genai.embed_content(model=self.model, content=texts, task_type=self.task_type)
+                return result["embedding"], None
+            except TRANSIENT_ERRORS as e:
+                if isinstance(e, (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)):
+                    self._shrink()
+                if attempt == self.max_retries:
+                    return None, e
+                delay = self._backoff(attempt)
+                EMBEDDING_RETRIES.inc()
+                print(f"Transient error embedding batch of {len(batch)} ({e}); retrying in {delay:.1f}s...")
+                time.sleep(delay)
+            except Exception as e:
+                return None, e
+
+    # --- Pipeline ---
+    def embed(self, items):
+        """
+        Embeds a list of (key, text) pairs and returns {key: vector} for the ones that succeeded.
+        Keys of batches that still fail are recorded in the failures file; keys that succeed are
+        cleared from it.
+        """
+        pending = deque(items)
+        retry_batches = deque()
+        embeddings = {}
+        failed_batches = []
+        total = len(items)
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            in_flight = {}
+            while pending or retry_batches or in_flight:
+                while (pending or retry_batches) and len(in_flight) < self.max_in_flight:
+                    if retry_batches:
+                        batch = retry_batches.popleft()
+                    else:
+                        batch = [pending.popleft() for _ in range(min(self.batch_size, len(pending)))]
+                    in_flight[executor.submit(self._embed_batch, batch)] = batch
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    vectors, error = future.result()
+                    if error is None:
+                        embeddings.update((key, vector) for (key, _), vector in zip(batch, vectors))
+                        self._grow()
+                        print(f"Embedded {len(embeddings)}/{total} texts (batch size {self.batch_size}).")
+                    elif is_oversize_error(error) and len(batch) > 1:
+                        self._shrink()
+                        middle = len(batch) // 2
+                        retry_batches.extend([batch[:middle], batch[middle:]])
+                    else:
+                        print(f"Error embedding batch of {len(batch)} after retries: {error}")
+                        failed_batches.append({
+                            "keys": [key for key, _ in batch],
+                            "error": str(error),
+                            "failed_at": datetime.now(timezone.utc).isoformat(),
+                        })
+
+        self._record_failures(set(embeddings), failed_batches)
+        if failed_batches:
+            failed = sum(len(batch["keys"]) for batch in failed_batches)
+            print(f"Warning: {failed} texts in {len(failed_batches)} batches failed to embed. See '{self.failures_path}'.")
+        return embeddings
+
+    # --- Failure record ---
+    def load_failures(self):
+        """Returns the list of previously failed batches ({keys, error, failed_at})."""
+        if not os.path.exists(self.failures_path):
+            return []
+        try:
+            with open(self.failures_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("batches", [])
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read failed batches record '{self.failures_path}': {e}")
+            return []
+
+    def pending_keys(self):
+        """Returns the keys of all texts that failed in a previous run and have not succeeded since."""
+        return {key for batch in self.load_failures() for key in batch["keys"]}
+
+    def prune_failures(self, valid_keys):
+        """Drops recorded failures for keys that no longer exist (e.g. chunks removed from the docs)."""
+        valid_keys = set(valid_keys)
+        batches = []
+        for batch in self.load_failures():
+            keys = [key for key in batch["keys"] if key in valid_keys]
+            if keys:
+                batches.append({**batch, "keys": keys})
+        self._write_failures(batches)
+
+    def _record_failures(self, succeeded_keys, new_failures):
+        retried_keys = {key for batch in new_failures for key in batch["keys"]}
+        batches = []
+        for batch in self.load_failures():
+            keys = [key for key in batch["keys"] if key not in succeeded_keys and key not in retried_keys]
+            if keys:
+                batches.append({**batch, "keys": keys})
+        batches.extend(new_failures)
+        self._write_failures(batches)
+
+    def _write_failures(self, batches):
+        if not batches:
+            if os.path.exists(self.failures_path):
+                os.remove(self.failures_path)
+            return
+        tmp_path = f"{self.failures_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model, "batches": batches}, f, indent=2)
+        os.replace(tmp_path, self.failures_path)
@@ -0,0 +1,266 @@
+"""
+Offline retrieval quality vs. cost evaluation for different chunking configurations.
+
+Each configuration chunks the book's docs, embeds the chunks into a local vector index (see
+local_index.py) and answers the labeled questions in eval_questions.json. A retrieved chunk is
+relevant if it comes from the question's source file and contains one of its evidence phrases,
+so labels do not depend on how the book was chunked. For every configuration the script reports:
+
+* recall@k (questions with a relevant chunk in the top k) and MRR, for dense and hybrid retrieval
+* index size on disk, number of chunks and estimated prompt tokens of the packed context
+* embedding calls and texts (indexing and queries) and query latency
+
+Configurations are `recursive:<chunk_size>:<overlap>` (index_book.py's splitter) or `elements`
+(ingest.py's per-element chunks, needs `unstructured`). Embeddings come from fakes.FakeEmbedder
+by default, or from Gemini with `--embedder gemini` (needs GEMINI_API_KEY).
+
+    python evaluate.py --configs recursive:500:50,recursive:1000:100,elements --output eval_results/latest.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime, timezone
+
+DEFAULT_CONFIGS = "recursive:500:50,recursive:1000:100,recursive:2000:200,elements"
+QUESTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_questions.json")
+
+
+class EmbeddingCallCounter:
+    """Wraps genai.embed_content so every call and embedded text is counted, whichever embedder is installed."""
+
+    def __init__(self, genai):
+        self.calls = 0
+        self.texts = 0
+        self.seconds = 0.0
+        original = genai.embed_content
+
+        def counted(*args, content=None, **kwargs):
+            self.calls += 1
+            self.texts += 1 if isinstance(content, str) else len(content)
+            start = time.perf_counter()
+            try:
+                return original(*args, content=content, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+
+        genai.embed_content = counted
+
+    def snapshot(self):
+        return self.calls, self.texts, self.seconds
+
+
+def load_questions(path: str = QUESTIONS_PATH) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_relevant(payload: dict, question: dict) -> bool:
+    if payload.get("source") != question["source"]:
+        return False
+    text = payload.get("page_content", "").casefold()
+    return any(phrase.casefold() in text for phrase in question["evidence"])
+
+
+def first_relevant_rank(hits, question) -> int | None:
+    for rank, hit in enumerate(hits, start=1):
+        if hit.payload and is_relevant(hit.payload, question):
+            return rank
+    return None
+
+
+def weak_labels(payloads, questions) -> list[int]:
+    """
+    Indexes of questions whose evidence matches no chunk of their source file, or most of them
+    (a label that matches most chunks makes any hit from that file count, inflating recall).
+    """
+    weak = []
+    for i, question in enumerate(questions):
+        source_chunks = [payload for payload in payloads if payload.get("source") == question["source"]]
+        matches = sum(is_relevant(payload, question) for payload in source_chunks)
+        if matches == 0 or (len(source_chunks) > 2 and matches * 2 >= len(source_chunks)):
+            weak.append(i)
+    return weak
+
+
+def score(ranks, ks) -> dict:
+    """recall@k for each k and MRR, from the rank of the first relevant hit per question (None = miss)."""
+    result = {f"recall@{k}": sum(rank is not None and rank <= k for rank in ranks) / len(ranks) for k in ks}
+    result["mrr"] = sum(1 / rank for rank in ranks if rank is not None) / len(ranks)
+    return result
+
+
+def chunk_docs(config: str, docs_path: str):
+    """Returns the chunks for a configuration, or raises ImportError if its parser is not installed."""
+    from parse_cache import parse_files
+
+    paths = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(docs_path)
+        for file in files
+        if file.endswith((".md", ".mdx"))
+    )
+    kind, *params = config.split(":")
+    if kind == "recursive":
+        import index_book
+
+        chunk_size, chunk_overlap = (int(value) for value in params)
+        settings = {"chunker": "recursive_character", "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+        parse_fn = index_book.split_doc
+    elif kind == "elements":
+        from ingest import partition_file
+
+        settings, parse_fn = {"chunker": "partition_md"}, partition_file
+    else:
+        raise ValueError(f"Unknown chunking configuration '{config}'.")
+    return [chunk for _, chunks in parse_files(paths, parse_fn, settings) for chunk in chunks]
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+def evaluate_config(config: str, questions, args, workdir: str, counter) -> dict:
+    from benchmark import percentile
+    from config import EMBEDDING_MODEL
+    from context_builder import estimate_tokens, pack_context
+    from embedding_pipeline import EmbeddingPipeline
+    from keyword_index import BM25Index, reciprocal_rank_fusion
+    from local_index import LocalVectorIndex
+
+    chunks = chunk_docs(config, args.docs)
+    payloads = [{"page_content": chunk["page_content"], **chunk["metadata"]} for chunk in chunks]
+    weak = weak_labels(payloads, questions)
+    if weak:
+        print(f"Warning: '{config}' has labels matching no chunk or most chunks of their source: questions {weak}")
+
+    calls, texts, seconds = counter.snapshot()
+    pipeline = EmbeddingPipeline(
+        model=EMBEDDING_MODEL, task_type="RETRIEVAL_DOCUMENT",
+        failures_path=os.path.join(workdir, "failed_embeddings.json"),
+    )
+    vectors = pipeline.embed([(chunk["id"], chunk["page_content"]) for chunk in chunks])
+    indexed = [i for i, chunk in enumerate(chunks) if chunk["id"] in vectors]
+    index_calls, index_texts, index_seconds = (value - before for value, before in zip(counter.snapshot(), (calls, texts, seconds)))
+
+    index_path = os.path.join(workdir, config.replace(":", "_"))
+    LocalVectorIndex.build(
+        ids=[chunks[i]["id"] for i in indexed],
+        vectors=[vectors[chunks[i]["id"]] for i in indexed],
+        payloads=[payloads[i] for i in indexed],
+        path=index_path,
+    )
+    index = LocalVectorIndex.load(index_path)
+    keyword_index = BM25Index({"id": chunks[i]["id"], **payloads[i]} for i in indexed)
+
+    calls, texts, seconds = counter.snapshot()
+    query_pipeline = EmbeddingPipeline(
+        model=EMBEDDING_MODEL, task_type="RETRIEVAL_QUERY",
+        failures_path=os.path.join(workdir, "failed_embeddings.json"),
+    )
+    query_vectors = query_pipeline.embed(list(enumerate(question["question"] for question in questions)))
+    query_calls, _, _ = (value - before for value, before in zip(counter.snapshot(), (calls, texts, seconds)))
+
+    top_k = max(args.k)
+    dense_ranks, hybrid_ranks, latencies, context_tokens = [], [], [], []
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        dense = index.search(query_vectors[i], limit=top_k, with_vectors=True) if i in query_vectors else []
+        latencies.append(time.perf_counter() - start)
+        lexical = keyword_index.search(question["question"], limit=top_k)
+        hybrid = reciprocal_rank_fusion([dense, lexical], limit=top_k) if dense else lexical
+        dense_ranks.append(first_relevant_rank(dense, question))
+        hybrid_ranks.append(first_relevant_rank(hybrid, question))
+        _, passages = pack_context(hybrid)
+        context_tokens.append(sum(estimate_tokens(passage) for passage in passages))
+
+    return {
+        "config": config,
+        "chunks": len(chunks),
+        "indexed_chunks": len(indexed),
+        "mean_chunk_chars": sum(len(chunk["page_content"]) for chunk in chunks) / len(chunks) if chunks else 0,
+        "index_bytes": directory_size(index_path),
+        "index_embed_calls": index_calls,
+        "index_embedded_texts": index_texts,
+        "index_embed_seconds": index_seconds,
+        "query_embed_calls": query_calls,
+        "dense": score(dense_ranks, args.k),
+        "hybrid": score(hybrid_ranks, args.k),
+        "query_latency_p50_ms": percentile([latency * 1000 for latency in latencies], 50),
+        "query_latency_p95_ms": percentile([latency * 1000 for latency in latencies], 95),
+        "mean_context_tokens": sum(context_tokens) / len(context_tokens) if context_tokens else 0,
+        "weak_labels": weak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunking configurations by retrieval quality and cost.")
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help="Comma-separated chunking configurations.")
+    parser.add_argument("--questions", default=QUESTIONS_PATH, help="Labeled questions JSON.")
+    parser.add_argument("--docs", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "docs"))
+    parser.add_argument("--k", default="1,3,5,10", help="Cut-offs for recall@k.")
+    parser.add_argument("--embedder", choices=["fake", "gemini"], default="fake")
+    parser.add_argument("--output", default=None, help="Where to write the JSON results (default: eval_results/<timestamp>.json).")
+    args = parser.parse_args()
+    args.k = sorted({int(k) for k in args.k.split(",")})
+
+    workdir = tempfile.mkdtemp(prefix="rag-eval-")
+    os.environ["PARSE_CACHE_DIR"] = os.path.join(workdir, "parse_cache")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import google.generativeai as genai
+    if args.embedder == "fake":
+        import fakes
+        fakes.install(fakes.FakeEmbedder(), fakes.FakeGenerator())
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        if not os.getenv("GEMINI_API_KEY"):
+            parser.error("--embedder gemini needs GEMINI_API_KEY.")
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    counter = EmbeddingCallCounter(genai)
+
+    from benchmark import git_revision
+
+    questions = load_questions(args.questions)
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "embedder": args.embedder,
+        "questions": len(questions),
+        "configs": [],
+    }
+    for config in args.configs.split(","):
+        print(f"Evaluating '{config}'...")
+        try:
+            results["configs"].append(evaluate_config(config.strip(), questions, args, workdir, counter))
+        except ImportError as e:
+            print(f"Skipping '{config}': missing dependency: {e}")
+            results["configs"].append({"config": config, "skipped": f"missing dependency: {e}"})
+
+    output = args.output or os.path.join("eval_results", f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    k = args.k[min(2, len(args.k) - 1)]
+    print(f"\n=== Evaluation results ({len(questions)} questions, {args.embedder} embeddings) ===")
+    print(f"{'config':<22}{'chunks':>7}{'index KB':>10}{'embed calls':>13}{f'dense R@{k}':>11}{f'hybrid R@{k}':>12}"
+          f"{'hybrid MRR':>12}{'ctx tokens':>12}{'p50 ms':>9}")
+    for summary in results["configs"]:
+        if "skipped" in summary:
+            print(f"{summary['config']:<22}skipped ({summary['skipped']})")
+            continue
+        print(
+            f"{summary['config']:<22}{summary['chunks']:>7}{summary['index_bytes'] / 1024:>10.1f}"
+            f"{summary['index_embed_calls'] + summary['query_embed_calls']:>13}"
+            f"{summary['dense'][f'recall@{k}']:>11.2f}{summary['hybrid'][f'recall@{k}']:>12.2f}"
+            f"{summary['hybrid']['mrr']:>12.2f}{summary['mean_context_tokens']:>12.0f}{summary['query_latency_p50_ms']:>9.2f}"
+        )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
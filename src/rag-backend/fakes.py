@@ -0,0 +1,125 @@
+import time
+import asyncio
+import hashlib
+
+import numpy as np
+import google.generativeai as genai
+
+from config import EMBEDDING_DIM
+from keyword_index import tokenize
+
+
+class FakeEmbedder:
+    """
+    Deterministic, offline stand-in for genai.embed_content / embed_content_async.
+
+    Texts are embedded with the hashing trick over their tokens, so texts that share words get
+    similar vectors and retrieval still behaves sensibly. `latency_ms` is added per call and
+    `per_text_latency_ms` per text in the call.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, latency_ms: float = 0.0, per_text_latency_ms: float = 0.0):
+        self.dim = dim
+        self.latency_s = latency_ms / 1000
+        self.per_text_latency_s = per_text_latency_ms / 1000
+        self.calls = 0
+        self.texts = 0
+
+    def vector(self, text: str) -> list[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text) or [text]:
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _result(self, content):
+        self.calls += 1
+        if isinstance(content, str):
+            self.texts += 1
+            return {"embedding": self.vector(content)}
+        self.texts += len(content)
+        return {"embedding": [self.vector(text) for text in content]}
+
+    def _delay(self, content) -> float:
+        return self.latency_s + self.per_text_latency_s * (1 if isinstance(content, str) else len(content))
+
+    def embed_content(self, model=None, content=None, task_type=None, **kwargs):
+        time.sleep(self._delay(content))
+        return self._result(content)
+
+    async def embed_content_async(self, model=None, content=None, task_type=None, **kwargs):
+        await asyncio.sleep(self._delay(content))
+        return self._result(content)
+
+
+class _FakeFeedback:
+    block_reason = None
+
+
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.prompt_feedback = _FakeFeedback()
+
+
+class _FakeStream:
+    def __init__(self, pieces, delay_s: float):
+        self._pieces = pieces
+        self._delay_s = delay_s
+
+    async def __aiter__(self):
+        for piece in self._pieces:
+            await asyncio.sleep(self._delay_s)
+            yield _FakeResponse(piece)
+
+
+class FakeGenerator:
+    """
+    Offline stand-in for genai.GenerativeModel. Answers take `latency_ms` in total; streamed
+    answers spread that latency across `stream_chunks` pieces.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, answer_words: int = 60, stream_chunks: int = 10):
+        self.latency_s = latency_ms / 1000
+        self.answer_words = answer_words
+        self.stream_chunks = max(1, stream_chunks)
+        self.calls = 0
+
+    def _answer(self, prompt: str) -> str:
+        words = [word for word in prompt.split() if word.isalpha()] or ["answer"]
+        return " ".join(words[i % len(words)] for i in range(self.answer_words))
+
+    def model(self, *args, **kwargs):
+        generator = self
+
+        class FakeGenerativeModel:
+            def __init__(self, *model_args, **model_kwargs):
+                pass
+
+            def generate_content(self, prompt, stream=False, **kwargs):
+                generator.calls += 1
+                time.sleep(generator.latency_s)
+                return _FakeResponse(generator._answer(prompt))
+
+            async def generate_content_async(self, prompt, stream=False, **kwargs):
+                generator.calls += 1
+                answer = generator._answer(prompt)
+                if not stream:
+                    await asyncio.sleep(generator.latency_s)
+                    return _FakeResponse(answer)
+                words = answer.split(" ")
+                size = -(-len(words) // generator.stream_chunks)
+                pieces = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+                return _FakeStream(pieces, generator.latency_s / len(pieces))
+
+        return FakeGenerativeModel(*args, **kwargs)
+
+
+def install(embedder: FakeEmbedder, generator: FakeGenerator):
+    """Routes every google.generativeai embedding and generation call in this process to the fakes."""
+    genai.configure = lambda *args, **kwargs: None
+    genai.embed_content = embedder.embed_content
+    genai.embed_content_async = embedder.embed_content_async
+    genai.GenerativeModel = generator.model
@@ -1,11 +1,20 @@
 import os
 import glob
-import uuid
+import argparse
 from dotenv import find_dotenv, load_dotenv
 from qdrant_client import QdrantClient, models
 import google.generativeai as genai
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from embedding_pipeline import EmbeddingPipeline, FAILED_BATCHES_PATH
+from keyword_index import BM25Index, KEYWORD_INDEX_PATH
+from local_index import LocalVectorIndex, LOCAL_INDEX_DIR
+from metrics import INDEXED_CHUNKS, export_run_metrics, stage_timer
+from index_manifest import content_hash, chunk_id, empty_manifest, load_manifest, save_manifest
+from parse_cache import parse_files
+from collection_aliases import create_version, pending_version, publish_version, resolve_collection
+from config import EMBEDDING_DIM, EMBEDDING_MODEL, full_vector, point_vector, vector_settings, vectors_config
+
 # --- Configuration ---
 # Load .env file from the project root
 dotenv_path = find_dotenv(filename='.env', raise_error_if_not_found=False)
@@ -18,57 +27,247 @@ QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-QDRANT_COLLECTION_NAME = "ai_book"
-EMBEDDING_MODEL = "models/text-embedding-004"
-VECTOR_SIZE = 768  # Gemini text-embedding-004 vector size
+QDRANT_COLLECTION_NAME = "ai_book"  # an alias to the live, versioned collection (see collection_aliases.py)
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))  # concurrent embedding batches
 DOCS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "docs")
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
 
 
 def get_all_docs():
-    """Reads all .mdx files from the specified docs directory."""
-    mdx_files = glob.glob(os.path.join(DOCS_PATH, "*.mdx"))
-    docs = []
-    for file_path in mdx_files:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            docs.append({"path": os.path.basename(file_path), "content": content})
+    """Lists all .mdx files in the specified docs directory."""
+    docs = sorted(glob.glob(os.path.join(DOCS_PATH, "*.mdx")))
     print(f"Found {len(docs)} documents to index from '{os.path.abspath(DOCS_PATH)}'.")
     return docs
 
-def get_text_chunks(docs):
-    """Splits documents into smaller chunks."""
+def split_doc(file_path, settings):
+    """Splits one document into chunks. Runs in a parse worker process."""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000, chunk_overlap=100, length_function=len
+        chunk_size=settings["chunk_size"], chunk_overlap=settings["chunk_overlap"], length_function=len
     )
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    source = os.path.basename(file_path)
     chunks = []
-    for doc in docs:
-        split_texts = text_splitter.split_text(doc["content"])
-        for i, text in enumerate(split_texts):
-            chunks.append({
-                "page_content": text,
-                "metadata": {"source": doc["path"], "chunk_index": i}
-            })
+    for i, text in enumerate(text_splitter.split_text(content)):
+        text_hash = content_hash(text)
+        chunks.append({
+            "id": chunk_id(source, i, text_hash),
+            "page_content": text,
+            "metadata": {"source": source, "chunk_index": i, "content_hash": text_hash}
+        })
+    return chunks
+
+def get_text_chunks(docs, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Splits documents into smaller chunks, in parallel and reusing cached splits of unchanged files."""
+    settings = {"chunker": "recursive_character", "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    chunks = []
+    for _, doc_chunks in parse_files(docs, split_doc, settings):
+        chunks.extend(doc_chunks)
     print(f"Split documents into {len(chunks)} chunks.")
     return chunks
 
-def get_embeddings_batch(texts, batch_size=100):
-    """Generates embeddings for a batch of texts."""
-    all_embeddings = []
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i+batch_size]
-        try:
-            result = genai.embed_content(
-                model=EMBEDDING_MODEL, content=batch_texts, task_type="RETRIEVAL_DOCUMENT"
+def get_embeddings_batch(texts, batch_size=100, keys=None):
+    """
+    Generates embeddings for a list of texts with a concurrent, retrying pipeline.
+    Returns a list aligned with `texts`, with None for texts that could not be embedded
+    (those are recorded under their key in the pipeline's failed batches file).
+    """
+    keys = list(keys) if keys is not None else list(range(len(texts)))
+    pipeline = EmbeddingPipeline(
+        model=EMBEDDING_MODEL,
+        task_type="RETRIEVAL_DOCUMENT",
+        max_in_flight=EMBED_MAX_IN_FLIGHT,
+        batch_size=batch_size,
+    )
+    embeddings = pipeline.embed(list(zip(keys, texts)))
+    return [embeddings.get(key) for key in keys]
+
+def plan_changes(chunks, manifest):
+    """Compares the current chunks with the manifest and returns (new_chunks, stale_ids)."""
+    indexed = manifest["chunks"]
+    current_ids = {chunk["id"] for chunk in chunks}
+    new_chunks = [chunk for chunk in chunks if chunk["id"] not in indexed]
+    stale_ids = [point_id for point_id in indexed if point_id not in current_ids]
+    return new_chunks, stale_ids
+
+def find_reusable_vectors(qdrant_client, new_chunks, manifest, stale_ids, collection_name=QDRANT_COLLECTION_NAME):
+    """
+    Looks up vectors for new chunks whose exact text is already indexed under a stale ID
+    (e.g. a chunk that only shifted position), so they can be re-keyed without re-embedding.
+    """
+    stale = set(stale_ids)
+    hash_to_id = {
+        entry["content_hash"]: point_id
+        for point_id, entry in manifest["chunks"].items()
+        if point_id in stale
+    }
+    wanted = {
+        chunk["id"]: hash_to_id[chunk["metadata"]["content_hash"]]
+        for chunk in new_chunks
+        if chunk["metadata"]["content_hash"] in hash_to_id
+    }
+    if not wanted:
+        return {}
+    records = qdrant_client.retrieve(
+        collection_name=collection_name,
+        ids=list(set(wanted.values())),
+        with_vectors=True,
+        with_payload=False,
+    )
+    vectors_by_old_id = {str(record.id): full_vector(record.vector) for record in records if record.vector}
+    return {
+        new_id: vectors_by_old_id[old_id]
+        for new_id, old_id in wanted.items()
+        if old_id in vectors_by_old_id
+    }
+
+def sync_changes(qdrant_client, chunks, new_chunks, stale_ids, manifest, collection_name=QDRANT_COLLECTION_NAME):
+    """
+    Embeds and upserts new chunks, deletes stale ones, and records both in the manifest.
+    Returns {chunk id: vector} for the chunks that were upserted.
+    """
+    reused_vectors = find_reusable_vectors(qdrant_client, new_chunks, manifest, stale_ids, collection_name)
+    to_embed = [chunk for chunk in new_chunks if chunk["id"] not in reused_vectors]
+    if reused_vectors:
+        print(f"Reusing {len(reused_vectors)} existing vectors for moved chunks.")
+
+    # Chunks from batches that failed on a previous run go first.
+    failures = EmbeddingPipeline(model=EMBEDDING_MODEL)
+    failures.prune_failures(chunk["id"] for chunk in chunks)
+    resumed = failures.pending_keys()
+    if resumed:
+        print(f"Resuming {len(resumed)} chunks from previously failed embedding batches.")
+        to_embed.sort(key=lambda chunk: chunk["id"] not in resumed)
+
+    with stage_timer("index_embed"):
+        embeddings = get_embeddings_batch(
+            [chunk["page_content"] for chunk in to_embed], keys=[chunk["id"] for chunk in to_embed]
+        )
+    INDEXED_CHUNKS.labels("reused").inc(len(reused_vectors))
+    INDEXED_CHUNKS.labels("embedded").inc(sum(emb is not None for emb in embeddings))
+    vectors = dict(reused_vectors)
+    vectors.update({chunk["id"]: emb for chunk, emb in zip(to_embed, embeddings) if emb is not None})
+    valid_chunks_with_embeddings = [(chunk, vectors[chunk["id"]]) for chunk in new_chunks if chunk["id"] in vectors]
+
+    if new_chunks and not valid_chunks_with_embeddings:
+        print("No embeddings were generated; leaving the index unchanged.")
+        return {}
+
+    if valid_chunks_with_embeddings:
+        print(f"Upserting {len(valid_chunks_with_embeddings)} vectors into Qdrant...")
+        with stage_timer("index_upsert"):
+            qdrant_client.upsert(
+                collection_name=collection_name,
+                points=[
+                    models.PointStruct(
+                        id=chunk["id"],
+                        vector=point_vector(emb),
+                        payload={
+                            "page_content": chunk["page_content"],
+                            "source": chunk["metadata"]["source"],
+                            "chunk_index": chunk["metadata"]["chunk_index"],
+                            "content_hash": chunk["metadata"]["content_hash"],
+                        },
+                    )
+                    for chunk, emb in valid_chunks_with_embeddings
+                ],
+                wait=True,
             )
-            all_embeddings.extend(result["embedding"])
-            print(f"Embedded batch {i//batch_size + 1}/{(len(texts) - 1)//batch_size + 1}")
-        except Exception as e:
-            print(f"Error embedding batch: {e}")
-            all_embeddings.extend([None] * len(batch_texts))
-    return all_embeddings
-
-def main():
-    """Main function to run the indexing process."""
+        for chunk, _ in valid_chunks_with_embeddings:
+            manifest["chunks"][chunk["id"]] = {
+                "source": chunk["metadata"]["source"],
+                "chunk_index": chunk["metadata"]["chunk_index"],
+                "content_hash": chunk["metadata"]["content_hash"],
+            }
+        INDEXED_CHUNKS.labels("upserted").inc(len(valid_chunks_with_embeddings))
+        save_manifest(manifest)
+        print("Successfully upserted documents into Qdrant.")
+
+    skipped = len(new_chunks) - len(valid_chunks_with_embeddings)
+    if skipped:
+        INDEXED_CHUNKS.labels("failed").inc(skipped)
+        print(f"Warning: {skipped} chunks could not be embedded and will be retried on the next run (see '{FAILED_BATCHES_PATH}').")
+
+    if stale_ids:
+        print(f"Deleting {len(stale_ids)} stale vectors from Qdrant...")
+        with stage_timer("index_delete"):
+            qdrant_client.delete(
+                collection_name=collection_name,
+                points_selector=models.PointIdsList(points=stale_ids),
+                wait=True,
+            )
+        for point_id in stale_ids:
+            manifest["chunks"].pop(point_id, None)
+        INDEXED_CHUNKS.labels("deleted").inc(len(stale_ids))
+        save_manifest(manifest)
+        print("Successfully removed stale documents from Qdrant.")
+
+    return {chunk["id"]: emb for chunk, emb in valid_chunks_with_embeddings}
+
+def build_keyword_index(chunks, manifest):
+    """Rebuilds the BM25 keyword index over the chunks that are currently indexed in Qdrant."""
+    indexed = [
+        {
+            "id": chunk["id"],
+            "page_content": chunk["page_content"],
+            "source": chunk["metadata"]["source"],
+            "chunk_index": chunk["metadata"]["chunk_index"],
+        }
+        for chunk in chunks
+        if chunk["id"] in manifest["chunks"]
+    ]
+    BM25Index(indexed).save(KEYWORD_INDEX_PATH)
+    print(f"Saved keyword index with {len(indexed)} chunks to '{KEYWORD_INDEX_PATH}'.")
+
+def build_local_index(qdrant_client, chunks, manifest, new_vectors, collection_name=QDRANT_COLLECTION_NAME):
+    """
+    Exports the indexed chunks and their vectors to the memory-mapped local index used by
+    RETRIEVAL_BACKEND=local. Vectors come from this run, the previous local index, or Qdrant.
+    """
+    indexed = [chunk for chunk in chunks if chunk["id"] in manifest["chunks"]]
+    vectors = {}
+    try:
+        vectors.update(LocalVectorIndex.load(LOCAL_INDEX_DIR).vectors_by_id())
+    except FileNotFoundError:
+        pass
+    vectors.update(new_vectors)
+
+    missing = [chunk["id"] for chunk in indexed if chunk["id"] not in vectors]
+    for i in range(0, len(missing), 256):
+        records = qdrant_client.retrieve(
+            collection_name=collection_name, ids=missing[i:i+256], with_vectors=True, with_payload=False
+        )
+        vectors.update({str(record.id): full_vector(record.vector) for record in records if record.vector})
+
+    indexed = [chunk for chunk in indexed if chunk["id"] in vectors]
+    LocalVectorIndex.build(
+        ids=[chunk["id"] for chunk in indexed],
+        vectors=[vectors[chunk["id"]] for chunk in indexed],
+        payloads=[
+            {
+                "page_content": chunk["page_content"],
+                "source": chunk["metadata"]["source"],
+                "chunk_index": chunk["metadata"]["chunk_index"],
+                "content_hash": chunk["metadata"]["content_hash"],
+            }
+            for chunk in indexed
+        ],
+        path=LOCAL_INDEX_DIR,
+    )
+    print(f"Saved local vector index with {len(indexed)} vectors to '{LOCAL_INDEX_DIR}'.")
+
+def main(full=False):
+    """
+    Main function to run the indexing process.
+
+    By default only chunks that are new or changed since the last run (according to the local
+    manifest) are embedded and upserted into the live collection, and chunks that no longer exist
+    are deleted. With full=True (or when the manifest does not match the live collection) a new
+    versioned collection is built, its point count checked against the chunks, and the `ai_book`
+    alias switched to it, so searches keep hitting the old version until the new one is complete.
+    If any chunk fails to embed the new version is left unpublished, and the next run resumes it.
+    """
     if not all([QDRANT_URL, QDRANT_API_KEY, GEMINI_API_KEY]):
         print("Error: Missing required environment variables (QDRANT_URL, QDRANT_API_KEY, GEMINI_API_KEY). Check your .env file.")
         return
@@ -81,43 +280,67 @@ def main():
         print(f"Error initializing clients: {e}")
         return
 
-    print(f"Recreating Qdrant collection: '{QDRANT_COLLECTION_NAME}'")
-    qdrant_client.recreate_collection(
-        collection_name=QDRANT_COLLECTION_NAME,
-        vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE),
+    manifest = load_manifest(QDRANT_COLLECTION_NAME)
+    live_collection = resolve_collection(qdrant_client, QDRANT_COLLECTION_NAME)
+    # Manifests from before vector settings were recorded describe plain full-size vectors.
+    same_vectors = manifest.get("vectors", {"dim": EMBEDDING_DIM, "compact_dim": 0, "quantization": "none"}) == vector_settings()
+    pending = pending_version(qdrant_client, QDRANT_COLLECTION_NAME)
+    resume = pending is not None and manifest.get("target") == pending and same_vectors
+    rebuild = (
+        resume or full or not manifest["chunks"] or live_collection is None
+        or manifest.get("target") != live_collection or not same_vectors
     )
-    print("Collection created successfully.")
-
-    docs = get_all_docs()
-    chunks = get_text_chunks(docs)
-    chunk_contents = [chunk["page_content"] for chunk in chunks]
-    embeddings = get_embeddings_batch(chunk_contents)
-    
-    valid_chunks_with_embeddings = [
-        (chunks[i], emb) for i, emb in enumerate(embeddings) if emb is not None
-    ]
+    if resume:
+        target = pending
+        print(f"Resuming unpublished collection version: '{target}' ({len(manifest['chunks'])} chunks already indexed)")
+    elif rebuild:
+        target = create_version(qdrant_client, QDRANT_COLLECTION_NAME, vectors_config())
+        print(f"Building new collection version: '{target}' ({vector_settings()})")
+        manifest = empty_manifest(QDRANT_COLLECTION_NAME)
+        manifest["target"] = target
+        manifest["vectors"] = vector_settings()
+        save_manifest(manifest)
+    else:
+        target = live_collection
 
-    if not valid_chunks_with_embeddings:
-        print("No embeddings were generated. Exiting.")
-        return
+    with stage_timer("index_chunk"):
+        docs = get_all_docs()
+        chunks = get_text_chunks(docs)
+    new_chunks, stale_ids = plan_changes(chunks, manifest)
+    print(f"{len(chunks) - len(new_chunks)} chunks unchanged, {len(new_chunks)} new or changed, {len(stale_ids)} stale.")
 
-    print(f"Upserting {len(valid_chunks_with_embeddings)} vectors into Qdrant...")
-    qdrant_client.upsert(
-        collection_name=QDRANT_COLLECTION_NAME,
-        points=[
-            models.PointStruct(
-                id=str(uuid.uuid4()),
-                vector=emb,
-                payload={
-                    "page_content": chunk["page_content"], 
-                    "source": chunk["metadata"]["source"]
-                },
-            )
-            for chunk, emb in valid_chunks_with_embeddings
-        ],
-        wait=True,
-    )
-    print("Successfully upserted documents into Qdrant.")
+    new_vectors = {}
+    if new_chunks or stale_ids:
+        new_vectors = sync_changes(qdrant_client, chunks, new_chunks, stale_ids, manifest, target)
+    else:
+        print("Index is already up to date.")
+
+    if rebuild:
+        missing = sum(chunk["id"] not in manifest["chunks"] for chunk in chunks)
+        if missing:
+            print(f"Error: not switching '{QDRANT_COLLECTION_NAME}' to '{target}': {missing} of {len(chunks)} chunks "
+                  "are not indexed yet. Run again to resume the new version.")
+            export_run_metrics(job="index_book")
+            return
+        try:
+            publish_version(qdrant_client, QDRANT_COLLECTION_NAME, target, len(chunks))
+        except RuntimeError as e:
+            print(f"Error: not switching '{QDRANT_COLLECTION_NAME}' to '{target}': {e}")
+            qdrant_client.delete_collection(collection_name=target)
+            return
+
+    with stage_timer("index_keyword"):
+        build_keyword_index(chunks, manifest)
+    with stage_timer("index_local_export"):
+        build_local_index(qdrant_client, chunks, manifest, new_vectors, target)
+
+    export_run_metrics(job="index_book")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Index the book's docs into Qdrant.")
+    parser.add_argument(
+        "--full", action="store_true",
+        help="Drop and rebuild the whole collection instead of only indexing changed chunks.",
+    )
+    args = parser.parse_args()
+    main(full=args.full)
@@ -0,0 +1,75 @@
+import os
+import json
+import uuid
+import hashlib
+from datetime import datetime, timezone
+
+# Local record of which chunks are already present in the Qdrant collection.
+MANIFEST_PATH = os.getenv(
+    "INDEX_MANIFEST_PATH", os.path.join(os.path.dirname(__file__), ".index_manifest.json")
+)
+
+# Fixed namespace so the same (source, chunk_index, content) always maps to the same point ID.
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c1c3e-0b7a-4d4f-9a52-5d1f3b8e2a10")
+
+
+def content_hash(text: str) -> str:
+    """Returns a stable SHA-256 hex digest of a chunk's text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source: str, chunk_index: int, text_hash: str) -> str:
+    """Builds a deterministic Qdrant point ID from a chunk's source, position and content hash."""
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{source}:{chunk_index}:{text_hash}"))
+
+
+def empty_manifest(collection_name: str) -> dict:
+    return {"collection": collection_name, "version": None, "updated_at": None, "chunks": {}}
+
+
+def load_manifest(collection_name: str, path: str = MANIFEST_PATH) -> dict:
+    """Loads the manifest, returning an empty one if it is missing, unreadable or for another collection."""
+    if not os.path.exists(path):
+        return empty_manifest(collection_name)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read index manifest '{path}': {e}. Starting from an empty manifest.")
+        return empty_manifest(collection_name)
+    if manifest.get("collection") != collection_name or not isinstance(manifest.get("chunks"), dict):
+        return empty_manifest(collection_name)
+    return manifest
+
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """Atomically writes the manifest, stamping a version derived from the indexed chunk IDs."""
+    digest = hashlib.sha256("\n".join(sorted(manifest["chunks"])).encode("utf-8")).hexdigest()
+    manifest["version"] = digest[:16]
+    manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+_version_cache = {"mtime": None, "version": None}
+
+
+def current_index_version(path: str = MANIFEST_PATH):
+    """
+    Returns the version stamped by the last successful index run, or None if there is no manifest.
+    The file is only re-read when its mtime changes, so this is cheap to call per request.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    if mtime != _version_cache["mtime"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                version = json.load(f).get("version")
+        except (OSError, ValueError):
+            return _version_cache["version"]
+        _version_cache.update(mtime=mtime, version=version)
+    return _version_cache["version"]
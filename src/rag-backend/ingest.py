@@ -1,47 +1,166 @@
-
 import os
+import threading
+from itertools import chain, islice
+from queue import Empty, Full, Queue
+
 from unstructured.partition.md import partition_md
 from qdrant_utils import qdrant_manager
+from index_manifest import chunk_id, content_hash
+from parse_cache import parse_files
+from metrics import INDEXED_CHUNKS, export_run_metrics, stage_timer
 
-def ingest_markdown_files(directory: str):
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))  # chunks per embed call and per upsert (API max 100)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))  # batches buffered between stages
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, maxsize: int = INGEST_QUEUE_SIZE):
     """
-    Ingests all markdown files from a directory into Qdrant.
+    Runs `iterable` in a background thread, buffering at most `maxsize` items ahead of the consumer.
+    A full queue blocks the producer, so a slow stage downstream throttles the stages before it.
     """
-    all_documents = []
-    all_metadatas = []
+    queue = Queue(maxsize=maxsize)
+    stop = threading.Event()
 
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_Failed(e))
+            return
+        put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue.
+        try:
+            while True:
+                queue.get_nowait()
+        except Empty:
+            pass
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_markdown_files(directory: str):
     for root, _, files in os.walk(directory):
-        for file in files:
+        for file in sorted(files):
             if file.endswith(".mdx") or file.endswith(".md"):
-                file_path = os.path.join(root, file)
-                print(f"Processing {file_path}...")
-                
-                # Use unstructured to partition the markdown file
-                elements = partition_md(filename=file_path)
-                
-                # Convert elements to simple text chunks
-                chunks = [str(el) for el in elements]
-                
-                for chunk in chunks:
-                    all_documents.append(chunk)
-                    all_metadatas.append({
-                        "source": file,
-                        "page_content": chunk
-                    })
-
-    print(f"Found {len(all_documents)} chunks to ingest.")
-
-    if all_documents:
-        # First, create the collection (this will reset it if it exists)
-        print("Creating Qdrant collection...")
-        qdrant_manager.create_collection()
-        
-        # Then, upsert the documents
-        print("Upserting documents to Qdrant...")
-        qdrant_manager.upsert_documents(documents=all_documents, metadatas=all_metadatas)
-        print("Ingestion complete!")
-    else:
+                yield os.path.join(root, file)
+
+
+def partition_file(file_path, settings):
+    """Partitions one markdown file into chunks of its non-empty elements. Runs in a parse worker process."""
+    file = os.path.basename(file_path)
+    texts = [text for text in (str(el) for el in partition_md(filename=file_path)) if text.strip()]
+    chunks = []
+    for chunk_index, text in enumerate(texts):
+        text_hash = content_hash(text)
+        chunks.append({
+            "id": chunk_id(file, chunk_index, text_hash),
+            "page_content": text,
+            "metadata": {"source": file, "chunk_index": chunk_index, "content_hash": text_hash},
+        })
+    return chunks
+
+
+def iter_chunks(paths):
+    """Partitions files across a process pool (reusing cached results) and yields their chunks in file order."""
+    for file_path, chunks in parse_files(paths, partition_file, {"chunker": "partition_md"}):
+        print(f"Processing {file_path}...")
+        yield from chunks
+
+
+def embed_batches(batches):
+    """
+    Yields (batch size, failed count, (chunk, vector) pairs) per batch. Chunks already in the
+    collection (from a resumed run) are skipped; chunks whose embedding failed are dropped (and recorded).
+    """
+    for batch in batches:
+        existing = qdrant_manager.existing_ids(c["id"] for c in batch)
+        todo = [c for c in batch if c["id"] not in existing]
+        vectors = {}
+        if todo:
+            with stage_timer("ingest_embed"):
+                vectors = qdrant_manager.embed_documents([c["id"] for c in todo], [c["page_content"] for c in todo])
+        failed = len(todo) - len(vectors)
+        INDEXED_CHUNKS.labels("failed").inc(failed)
+        yield len(batch), failed, [(c, vectors[c["id"]]) for c in todo if c["id"] in vectors]
+
+
+def ingest_markdown_files(directory: str):
+    """
+    Ingests all markdown files from a directory into Qdrant.
+
+    Files are parsed, embedded and upserted as a stream of fixed-size batches, with parsing and
+    embedding each running a few batches ahead in their own thread, so memory stays bounded by
+    the queue sizes and upserts start as soon as the first batch is embedded.
+    """
+    chunks = prefetch(iter_chunks(iter_markdown_files(directory)), maxsize=INGEST_BATCH_SIZE * INGEST_QUEUE_SIZE)
+    first = next(chunks, None)
+    if first is None:
         print("No documents found to ingest.")
+        return
+
+    # Build into a new collection version; the live one keeps serving searches until the switch.
+    print(f"Building Qdrant collection {qdrant_manager.create_collection()}...")
+
+    print("Embedding and upserting documents to Qdrant...")
+    produced = failed = total = 0
+    embedded = prefetch(embed_batches(batched(chain([first], chunks), INGEST_BATCH_SIZE)))
+    for batch_size, batch_failed, batch in embedded:
+        produced += batch_size
+        failed += batch_failed
+        if not batch:
+            continue
+        with stage_timer("ingest_upsert"):
+            qdrant_manager.upsert_points(
+                [c["id"] for c, _ in batch],
+                [vector for _, vector in batch],
+                [{"page_content": c["page_content"], **c["metadata"]} for c, _ in batch],
+            )
+        INDEXED_CHUNKS.labels("upserted").inc(len(batch))
+        total += len(batch)
+        print(f"Upserted {total} chunks...")
+
+    if failed:
+        name = qdrant_manager.leave_unpublished()
+        print(f"Error: {failed} of {produced} chunks could not be embedded; leaving '{name}' unpublished. "
+              "Run again to resume it.")
+    else:
+        qdrant_manager.publish_collection(expected_points=produced)
+        print(f"Ingestion complete! {total} chunks upserted.")
+    export_run_metrics(job="ingest")
 
 if __name__ == '__main__':
     # This script will ingest the content from the `docs` directory
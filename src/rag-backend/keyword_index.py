@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import math
+from collections import Counter, defaultdict, namedtuple
+
+# Written by index_book.py next to the manifest and loaded by main.py at startup.
+KEYWORD_INDEX_PATH = os.getenv(
+    "KEYWORD_INDEX_PATH", os.path.join(os.path.dirname(__file__), "keyword_index.json")
+)
+
+# Same shape as Qdrant's ScoredPoint (id, score, payload, vector) so hits can be used interchangeably.
+ScoredChunk = namedtuple("ScoredChunk", ["id", "score", "payload", "vector"], defaults=[None])
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its of on or that the this to "
+    "what when where which who why with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.casefold()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring over the same chunks that are stored in Qdrant.
+    Chunks are dicts with `id`, `page_content`, `source` and `chunk_index`.
+    """
+
+    def __init__(self, chunks=(), k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = list(chunks)
+        self.postings = defaultdict(list)  # term -> [(chunk position, term frequency)]
+        self.doc_lengths = []
+        for position, chunk in enumerate(self.chunks):
+            counts = Counter(tokenize(chunk["page_content"]))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                self.postings[term].append((position, frequency))
+        self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        n = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query: str, limit: int = 5) -> list[ScoredChunk]:
+        """Returns the `limit` best chunks for the query, highest BM25 score first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[position] / self.avg_doc_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [
+            ScoredChunk(
+                id=self.chunks[position]["id"],
+                score=score,
+                payload={key: value for key, value in self.chunks[position].items() if key != "id"},
+            )
+            for position, score in best
+        ]
+
+    def save(self, path: str = KEYWORD_INDEX_PATH):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "chunks": self.chunks}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = KEYWORD_INDEX_PATH) -> "BM25Index":
+        """Loads a saved index, returning an empty one if the file does not exist."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["chunks"], k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+
+
+def reciprocal_rank_fusion(result_lists, limit: int = 5, k: int = 60) -> list[ScoredChunk]:
+    """Merges ranked hit lists (dense, lexical, ...) by summing 1 / (k + rank) for each chunk."""
+    scores = defaultdict(float)
+    payloads = {}
+    vectors = {}
+    for results in result_lists:
+        for rank, hit in enumerate(results):
+            key = str(hit.id)
+            scores[key] += 1.0 / (k + rank + 1)
+            if hit.payload:
+                payloads.setdefault(key, hit.payload)
+            if getattr(hit, "vector", None) is not None:
+                vectors.setdefault(key, hit.vector)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [ScoredChunk(id=key, score=score, payload=payloads.get(key), vector=vectors.get(key)) for key, score in ranked]
@@ -0,0 +1,166 @@
+import os
+import json
+import mmap
+import shutil
+
+import numpy as np
+
+from config import COMPACT_EMBEDDING_DIM, RESCORE_OVERSAMPLING, VECTOR_QUANTIZATION
+from keyword_index import ScoredChunk
+
+# Written by index_book.py; searched in-process by main.py when RETRIEVAL_BACKEND=local.
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(os.path.dirname(__file__), "local_index"))
+
+VECTORS_FILE = "vectors.npy"    # float32 (n, dim), rows L2-normalized
+OFFSETS_FILE = "offsets.npy"    # int64 (n + 1,), byte offsets of each row's record in PAYLOADS_FILE
+PAYLOADS_FILE = "payloads.jsonl"  # one {"id": ..., "payload": {...}} record per row
+COARSE_FILE = "coarse.npy"      # optional first-pass matrix: compact and/or quantized copies of the rows
+SETTINGS_FILE = "settings.json"  # {"compact_dim": ..., "quantization": ...} the coarse matrix was built with
+
+# Number of set bits in each byte value, for Hamming distances between packed binary vectors.
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class LocalVectorIndex:
+    """
+    Exact cosine-similarity search over a memory-mapped float32 matrix. Payloads live in a JSONL
+    file and are only decoded for the rows that make it into the top k.
+
+    If the index was built with compact and/or quantized vectors, a first pass over that (small,
+    in-RAM) coarse matrix picks limit * RESCORE_OVERSAMPLING candidates, and only their full
+    rows are read from the memory map for exact rescoring.
+    """
+
+    def __init__(self, vectors, offsets, payloads, coarse=None, settings=None):
+        self.vectors = vectors
+        self.offsets = offsets
+        self._payloads = payloads
+        self.coarse = coarse
+        self.settings = settings or {"compact_dim": 0, "quantization": "none"}
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _record(self, row: int) -> dict:
+        return json.loads(self._payloads[self.offsets[row]:self.offsets[row + 1]])
+
+    @staticmethod
+    def _top(scores, limit):
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        return top[np.argsort(-scores[top])]
+
+    @classmethod
+    def _coarse_rows(cls, matrix, compact_dim: int, quantization: str):
+        """Compact and/or quantize normalized full vectors (rows or a single query) for the first pass."""
+        if compact_dim:
+            matrix = cls._normalize(matrix[..., :compact_dim])
+        if quantization == "scalar":
+            return np.clip(np.rint(matrix * 127), -127, 127).astype(np.int8)
+        if quantization == "binary":
+            return np.packbits(matrix > 0, axis=-1)
+        return matrix.astype(np.float32)
+
+    def _coarse_scores(self, query):
+        compact_dim, quantization = self.settings["compact_dim"], self.settings["quantization"]
+        if quantization == "binary":
+            bits = self._coarse_rows(query, compact_dim, quantization)
+            return -POPCOUNT[np.bitwise_xor(self.coarse, bits)].sum(axis=1, dtype=np.int32).astype(np.float32)
+        if compact_dim:
+            query = self._normalize(query[:compact_dim])
+        return self.coarse.astype(np.float32, copy=False) @ query
+
+    def search(self, vector, limit: int = 5, with_vectors: bool = False) -> list[ScoredChunk]:
+        """Returns the `limit` rows most similar to `vector`, best first."""
+        if not len(self):
+            return []
+        query = self._normalize(np.asarray(vector, dtype=np.float32))
+        if self.coarse is None:
+            scores = self.vectors @ query
+            top = self._top(scores, limit)
+            top_scores = scores[top]
+        else:
+            candidates = np.sort(self._top(self._coarse_scores(query), int(np.ceil(limit * RESCORE_OVERSAMPLING))))
+            rescored = self.vectors[candidates] @ query
+            order = self._top(rescored, limit)
+            top, top_scores = candidates[order], rescored[order]
+        hits = []
+        for row, score in zip(top, top_scores):
+            record = self._record(row)
+            hits.append(ScoredChunk(
+                id=record["id"], score=float(score), payload=record["payload"],
+                vector=self.vectors[row] if with_vectors else None,
+            ))
+        return hits
+
+    def search_batch(self, vectors, limit: int = 5, with_vectors: bool = False) -> list[list[ScoredChunk]]:
+        """`search` for many query vectors; without a coarse matrix all queries share one matrix product."""
+        if self.coarse is not None or not len(self) or not len(vectors):
+            return [self.search(vector, limit, with_vectors) for vector in vectors]
+        queries = self._normalize(np.asarray(vectors, dtype=np.float32))
+        all_scores = self.vectors @ queries.T
+        results = []
+        for column in range(all_scores.shape[1]):
+            scores = all_scores[:, column]
+            hits = []
+            for row in self._top(scores, limit):
+                record = self._record(row)
+                hits.append(ScoredChunk(
+                    id=record["id"], score=float(scores[row]), payload=record["payload"],
+                    vector=self.vectors[row] if with_vectors else None,
+                ))
+            results.append(hits)
+        return results
+
+    def vectors_by_id(self) -> dict:
+        """Returns {id: vector} for every row, e.g. to reuse unchanged vectors when rebuilding."""
+        return {self._record(row)["id"]: self.vectors[row].tolist() for row in range(len(self))}
+
+    @classmethod
+    def build(
+        cls, ids, vectors, payloads, path: str = LOCAL_INDEX_DIR,
+        compact_dim: int = COMPACT_EMBEDDING_DIM, quantization: str = VECTOR_QUANTIZATION,
+    ):
+        """Writes a new index to `path`, replacing any existing one only once it is complete."""
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        matrix = cls._normalize(matrix.reshape(len(ids), -1)) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(tmp_path, VECTORS_FILE), matrix)
+        if len(ids) and (compact_dim or quantization != "none"):
+            np.save(os.path.join(tmp_path, COARSE_FILE), cls._coarse_rows(matrix, compact_dim, quantization))
+            with open(os.path.join(tmp_path, SETTINGS_FILE), "w", encoding="utf-8") as f:
+                json.dump({"compact_dim": compact_dim, "quantization": quantization}, f)
+
+        offsets = [0]
+        with open(os.path.join(tmp_path, PAYLOADS_FILE), "wb") as f:
+            for point_id, payload in zip(ids, payloads):
+                line = json.dumps({"id": point_id, "payload": payload}).encode("utf-8") + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(tmp_path, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = LOCAL_INDEX_DIR) -> "LocalVectorIndex":
+        """Memory-maps a saved index. Raises FileNotFoundError if none has been built."""
+        vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        with open(os.path.join(path, PAYLOADS_FILE), "rb") as f:
+            payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        coarse, settings = None, None
+        if os.path.exists(os.path.join(path, COARSE_FILE)):
+            coarse = np.load(os.path.join(path, COARSE_FILE))
+            with open(os.path.join(path, SETTINGS_FILE), "r", encoding="utf-8") as f:
+                settings = json.load(f)
+        return cls(vectors, offsets, payloads, coarse, settings)
@@ -1,20 +1,39 @@
 import os
+import json
+import time
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException, Depends
+from contextlib import asynccontextmanager, AsyncExitStack
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from fastapi.staticfiles import StaticFiles # Added
-from starlette.responses import FileResponse # Added
+from starlette.responses import JSONResponse, Response, StreamingResponse # Added
+from starlette.background import BackgroundTask
 from pathlib import Path # Added
 
-from database import get_db
-from auth import authenticate_user, create_user, User
+from database import engine, get_db, ping_database
+from config import EMBEDDING_MODEL
+from embedding_cache import QueryEmbeddingCache
+from embed_batcher import QueryEmbeddingBatcher
+from answer_cache import SemanticAnswerCache
+from keyword_index import BM25Index, reciprocal_rank_fusion
+from context_builder import pack_context
+from retrievers import QdrantRetriever, LocalRetriever
+from resilience import CircuitOpenError, Guard
+from metrics import (
+    FALLBACKS, REJECTED_REQUESTS, REQUESTS_IN_FLIGHT, STAGE_DURATION, register_stats, render_latest, stage_timer,
+)
+from password_hashing import shutdown as shutdown_password_hashing
+from auth import init_db, authenticate_user, create_session_token, create_user, get_user_by_email, verify_session_token
 from models import UserCreate, UserLogin
+from static_files import StaticSite
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,28 +47,199 @@ QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 QDRANT_COLLECTION_NAME = "ai_book"
-EMBEDDING_MODEL = "models/text-embedding-004"
+# "qdrant" queries the remote collection; "local" searches the memory-mapped index written by index_book.py.
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "qdrant").lower()
 GENERATIVE_MODEL = "gemini-1.5-flash-latest"
 
-# Validate environment variables
-if not all([QDRANT_URL, QDRANT_API_KEY, GEMINI_API_KEY]):
-    logger.error("Missing one or more required environment variables (QDRANT_URL, QDRANT_API_KEY, GEMINI_API_KEY).")
-    raise ConnectionError("Missing required environment variables. Please check your .env file.")
+# --- Concurrency & Timeouts ---
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "32"))  # searches running at once per worker
+SEARCH_QUEUE_TIMEOUT_S = float(os.getenv("SEARCH_QUEUE_TIMEOUT_S", "5"))  # max wait for a free slot before 503
+EMBED_TIMEOUT_S = float(os.getenv("EMBED_TIMEOUT_S", "5"))
+RETRIEVE_TIMEOUT_S = float(os.getenv("RETRIEVE_TIMEOUT_S", "5"))
+GENERATE_TIMEOUT_S = float(os.getenv("GENERATE_TIMEOUT_S", "30"))
+
+# --- Batch Search ---
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "1000"))
+SEARCH_BATCH_GENERATE_CONCURRENCY = int(os.getenv("SEARCH_BATCH_GENERATE_CONCURRENCY", "8"))  # answers generated at once per batch
+EMBED_BATCH_SIZE = 100  # texts per embedding call (API max)
+RETRIEVE_BATCH_SIZE = 64  # searches per query_batch_points call
+
+# --- Hybrid Retrieval ---
+# Candidates left after fusion; context_builder picks the prompt's chunks from these within its token budget.
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # candidates fetched from each retriever
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
+
+# --- Warm-up & Readiness ---
+WARM_UP_TIMEOUT_S = float(os.getenv("WARM_UP_TIMEOUT_S", "10"))  # per dependency, at startup
+WARM_UP_GEMINI = os.getenv("WARM_UP_GEMINI", "true").lower() in ("1", "true", "yes")  # one tiny embedding call per worker
+READY_CHECK_TIMEOUT_S = float(os.getenv("READY_CHECK_TIMEOUT_S", "2"))
+
+# --- Clients ---
+# Created by init_clients() when the app starts (or on first use when the app is driven without its
+# lifespan), so importing this module is cheap and never touches the network.
+retriever = None
+generative_model = None
+embedding_cache = None
+embedding_batcher = None
+answer_cache = None
+keyword_index = None
+# Circuit breakers, deadlines and optional hedging for the two Gemini dependencies.
+embed_guard = Guard("embed", timeout_s=EMBED_TIMEOUT_S)
+generate_guard = Guard("generate", timeout_s=GENERATE_TIMEOUT_S)
+clients_ready = False
+warmed_up = False
+dependency_status = {}  # name -> outcome of its last check, reported by /healthz and /readyz
+
+def check_config():
+    """Raises if the retrieval backend is unknown or its required environment variables are missing."""
+    if RETRIEVAL_BACKEND not in ("qdrant", "local"):
+        raise ValueError(f"Unknown RETRIEVAL_BACKEND '{RETRIEVAL_BACKEND}'. Use 'qdrant' or 'local'.")
+    required_env = {"GEMINI_API_KEY": GEMINI_API_KEY}
+    if RETRIEVAL_BACKEND == "qdrant":
+        required_env.update(QDRANT_URL=QDRANT_URL, QDRANT_API_KEY=QDRANT_API_KEY)
+    if not all(required_env.values()):
+        logger.error(f"Missing one or more required environment variables ({', '.join(required_env)}).")
+        raise ConnectionError("Missing required environment variables. Please check your .env file.")
+
+def init_clients():
+    """
+    Creates the clients and indexes the endpoints use. Anything already set (e.g. a retriever
+    swapped in by the benchmark) is kept. No network calls happen here; see warm_up().
+    """
+    global retriever, generative_model, embedding_cache, embedding_batcher, answer_cache, keyword_index, clients_ready
+    if clients_ready:
+        return
+    check_config()
+    try:
+        if retriever is None and RETRIEVAL_BACKEND == "local":
+            retriever = LocalRetriever()
+            if retriever.index is None:
+                logger.warning(f"Local vector index not found at '{retriever.path}'; run `python index_book.py` to build it.")
+            else:
+                logger.info(f"Loaded local vector index with {len(retriever.index)} vectors.")
+        elif retriever is None:
+            retriever = QdrantRetriever(AsyncQdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY), QDRANT_COLLECTION_NAME)
+        genai.configure(api_key=GEMINI_API_KEY)
+        generative_model = generative_model or genai.GenerativeModel(GENERATIVE_MODEL)
+        embedding_cache = embedding_cache or QueryEmbeddingCache(model=EMBEDDING_MODEL)
+        embedding_batcher = embedding_batcher or QueryEmbeddingBatcher(model=EMBEDDING_MODEL, guard=embed_guard)
+        answer_cache = answer_cache or SemanticAnswerCache()
+        if keyword_index is None:
+            keyword_index = BM25Index.load()
+            if len(keyword_index):
+                logger.info(f"Loaded keyword index with {len(keyword_index)} chunks.")
+            else:
+                logger.warning("Keyword index not found; run `python index_book.py` to enable hybrid and lexical search.")
+        register_stats({
+            "query_embedding_cache": embedding_cache.stats,
+            "query_embedding_batcher": embedding_batcher.stats,
+            "answer_cache": answer_cache.stats,
+            "embed_circuit": embed_guard.stats,
+            "generate_circuit": generate_guard.stats,
+        })
+    except Exception as e:
+        logger.error(f"Failed to initialize clients: {e}")
+        raise
+    clients_ready = True
+    logger.info(f"Successfully set up the '{RETRIEVAL_BACKEND}' retrieval backend and configured Gemini.")
+
+def require_clients():
+    """Endpoint dependency: initializes the clients on first use if startup has not."""
+    if not clients_ready:
+        try:
+            init_clients()
+        except Exception:
+            raise HTTPException(status_code=503, detail="The chatbot is not configured yet. Please try again later.")
+
+async def check_dependency(name: str, probe, timeout_s: float = WARM_UP_TIMEOUT_S) -> bool:
+    """Awaits `probe()` with a deadline and records the outcome (and any details it returns) in dependency_status."""
+    start = time.perf_counter()
+    try:
+        details = await asyncio.wait_for(probe(), timeout=timeout_s)
+        status = {"ok": True, **(details or {})}
+    except Exception as e:
+        logger.warning(f"Dependency check '{name}' failed: {e!r}")
+        status = {"ok": False, "error": repr(e)}
+    dependency_status[name] = {**status, "latency_ms": round((time.perf_counter() - start) * 1000, 1)}
+    return status["ok"]
+
+async def warm_up_embedding():
+    await embedding_batcher.embed_many(["warm up"])
 
-# --- Initialize Clients ---
-try:
-    qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-    genai.configure(api_key=GEMINI_API_KEY)
-    logger.info("Successfully connected to Qdrant and configured Gemini.")
-except Exception as e:
-    logger.error(f"Failed to initialize clients: {e}")
-    raise
+async def warm_up():
+    """
+    Opens connections before the first real request: a vector index round trip (or page-in of the
+    local index), a database ping and, if WARM_UP_GEMINI, one embedding call. /readyz answers 503 until this is done.
+    """
+    global warmed_up
+    checks = [
+        check_dependency("vector_index", retriever.warm_up),
+        check_dependency("database", lambda: asyncio.to_thread(ping_database)),
+    ]
+    if WARM_UP_GEMINI:
+        checks.append(check_dependency("gemini_embedding", warm_up_embedding))
+    await asyncio.gather(*checks)
+    dependency_status["keyword_index"] = {"ok": len(keyword_index) > 0, "chunks": len(keyword_index)}
+    warmed_up = True
+    summary = ", ".join(f"{name}={'ok' if status['ok'] else 'failed'}" for name, status in dependency_status.items())
+    logger.info(f"Warm-up complete: {summary}.")
+
+async def close_clients():
+    if retriever is not None:
+        await retriever.close()
+    shutdown_password_hashing()
+    engine.dispose()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    init_clients()
+    # Warm up in the background so /healthz answers right away; /readyz flips to 200 when it is done.
+    background_tasks = [asyncio.create_task(warm_up())]
+    if static_site is not None:
+        await asyncio.to_thread(static_site.load)
+        # Compression (and, with STATIC_PRECOMPRESS_ON_STARTUP, .br/.gz files for large assets) happens after startup.
+        background_tasks.append(asyncio.create_task(asyncio.to_thread(static_site.compress_in_background)))
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await close_clients()
+
+# Bounds how many searches run at once so a burst queues briefly instead of piling onto Gemini.
+search_semaphore = asyncio.Semaphore(SEARCH_MAX_CONCURRENCY)
+
+@asynccontextmanager
+async def search_slot(endpoint: str, timeout_s: float | None = SEARCH_QUEUE_TIMEOUT_S):
+    """Acquires a search slot, answering 503 if none frees up within `timeout_s` (None waits as long as it takes)."""
+    try:
+        await asyncio.wait_for(search_semaphore.acquire(), timeout=timeout_s)
+    except asyncio.TimeoutError:
+        logger.warning("No free search slot; rejecting request.")
+        REJECTED_REQUESTS.labels(endpoint).inc()
+        raise HTTPException(status_code=503, detail="The chatbot is busy right now. Please try again in a moment.")
+    REQUESTS_IN_FLIGHT.labels(endpoint).inc()
+    try:
+        yield
+    finally:
+        REQUESTS_IN_FLIGHT.labels(endpoint).dec()
+        search_semaphore.release()
 
 # --- FastAPI App ---
 app = FastAPI(
     title="AI & Humanoid Robotics Textbook RAG Backend",
     description="A RAG backend using Qdrant and Gemini for the AI textbook.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS Middleware
@@ -66,30 +256,50 @@ class SearchQuery(BaseModel):
     query: str
     selected_text: str | None = None
 
+    @property
+    def search_text(self) -> str:
+        return f"{self.query} {self.selected_text or ''}".strip()
+
 # --- Fallback Answer Generation ---
 def generate_fallback_answer(context: str, query: str) -> str:
     """Generates a simple, context-based answer if Gemini fails."""
     logger.warning("Falling back to context-based answer generation.")
+    FALLBACKS.labels("answer").inc()
     if "No relevant context" in context:
         return f"I couldn't find specific information for your query '{query}' in the book. The book covers topics like Embodied Intelligence, ROS 2, Navigation, and Humanoid Robot Design. Please try a more specific question."
     else:
         return f"Based on the retrieved context, here is some information related to your query '{query}':\n\n{context[:1000]}...\n\nI am currently having trouble connecting to the advanced AI model. This information is based on keyword search."
 
 # --- Core RAG Functions ---
-def get_embedding(text: str) -> list[float]:
-    """Generates embedding for a given text using Gemini, with a fallback to a dummy vector."""
+async def get_embedding(text: str) -> list[float] | None:
+    """
+    Generates embedding for a given text using Gemini. Returns None if embedding fails, in which
+    case search runs on the keyword index alone.
+    Repeat queries are served from the query embedding cache without calling Gemini, and
+    concurrent misses are sent to Gemini together by the micro-batcher.
+    While the embedding circuit is open, this returns None right away.
+    """
+    cached = await embedding_cache.get(text)
+    if cached is not None:
+        logger.info("Using cached query embedding.")
+        return cached
     try:
-        result = genai.embed_content(model=EMBEDDING_MODEL, content=text, task_type="RETRIEVAL_QUERY")
+        # The batcher runs the shared upstream call through embed_guard; this only bounds our wait.
+        embedding = await asyncio.wait_for(embedding_batcher.embed(text), timeout=EMBED_TIMEOUT_S)
         logger.info("Successfully generated embedding using Gemini.")
-        return result["embedding"]
+        await embedding_cache.put(text, embedding)
+        return embedding
+    except CircuitOpenError:
+        logger.warning("Embedding circuit is open. Falling back to keyword search.")
+        FALLBACKS.labels("embedding_circuit_open").inc()
+        return None
     except Exception as e:
-        logger.error(f"Failed to generate embedding: {e}. Falling back to dummy embedding.")
-        # Return a dummy vector of the correct dimension (768 for text-embedding-004)
-        return [0.0] * 768
+        logger.error(f"Failed to generate embedding: {e!r}. Falling back to keyword search.")
+        FALLBACKS.labels("keyword_search").inc()
+        return None
 
-def generate_gemini_answer(context: str, query: str, selected_text: str | None) -> str:
-    """Generates an answer using Gemini based on context and a query."""
-    prompt = f"""
+def build_prompt(context: str, query: str, selected_text: str | None) -> str:
+    return f"""
 You are an expert assistant for the \"AI & Humanoid Robotics\" textbook. Your tone should be helpful, technical, and clear.
 Based *only* on the provided context, answer the user's query. If the context is not sufficient, state that you cannot answer from the given information.
 
@@ -104,109 +314,468 @@ USER'S QUERY:
 
 Provide a concise, beginner-friendly answer in the same language as the query.
 """
+
+async def request_gemini_answer(context: str, query: str, selected_text: str | None) -> str | None:
+    """Generates an answer using Gemini based on context and a query. Returns None if Gemini fails or its circuit is open."""
+    prompt = build_prompt(context, query, selected_text)
     logger.info("Attempting to generate answer with Gemini.")
     try:
-        model = genai.GenerativeModel(GENERATIVE_MODEL)
-        response = model.generate_content(
-            prompt,
-            safety_settings={
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
+        response = await generate_guard.call(
+            lambda: generative_model.generate_content_async(prompt, safety_settings=SAFETY_SETTINGS)
         )
         if response.prompt_feedback.block_reason:
             logger.error(f"Prompt was blocked by Gemini: {response.prompt_feedback.block_reason}")
-            return generate_fallback_answer(context, query)
+            FALLBACKS.labels("generation_blocked").inc()
+            return None
         
         logger.info("Successfully generated answer with Gemini.")
         return response.text
+    except CircuitOpenError:
+        logger.warning("Generation circuit is open. Serving the fallback answer.")
+        FALLBACKS.labels("generation_circuit_open").inc()
+        return None
     except Exception as e:
-        logger.error(f"Gemini generation failed: {e}", exc_info=True)
-        return generate_fallback_answer(context, query)
+        logger.error(f"Gemini generation failed: {e!r}", exc_info=True)
+        FALLBACKS.labels("generation_timeout" if isinstance(e, asyncio.TimeoutError) else "generation_error").inc()
+        return None
+
+async def retrieve(query_embedding: list[float], limit: int = 5, with_vectors: bool = False):
+    """Searches the vector index for the chunks closest to the query embedding, mapping failures to HTTP errors."""
+    try:
+        search_result = await asyncio.wait_for(
+            retriever.search(query_embedding, limit, with_vectors=with_vectors), timeout=RETRIEVE_TIMEOUT_S
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"Vector search timed out after {RETRIEVE_TIMEOUT_S}s.")
+        raise HTTPException(status_code=504, detail="Searching the book took too long. Please try again.")
+    except Exception as e:
+        logger.error(f"Vector search failed: {e}", exc_info=True)
+        raise search_error(e)
+    logger.info(f"Found {len(search_result)} results from the '{RETRIEVAL_BACKEND}' index.")
+    return search_result
+
+def search_error(e: Exception) -> HTTPException:
+    """Maps a vector search failure to the HTTP error shown to the user."""
+    error_message = str(e).lower()
+    if "not found" in error_message or "not exist" in error_message:
+        detail = "Chatbot Error: The book content has not been indexed. Please run the `python index_book.py` (or `python ingest.py`) script in the `src/rag-backend` directory to set up the database."
+        return HTTPException(status_code=500, detail=detail)
+    detail = f"Failed to search for context in database. Please check your Qdrant connection and ensure the server is running."
+    return HTTPException(status_code=500, detail=detail)
+
+def build_context(passages, selected_text: str | None) -> str:
+    """Joins the user's highlighted text and the packed passages into the prompt context."""
+    context_parts = []
+    if selected_text:
+        context_parts.append(f"User highlighted text: {selected_text}")
+
+    retrieved_chunks = [passage for passage in passages if passage]
+
+    if retrieved_chunks:
+        context_parts.append("Relevant content from the book:\n" + "\n\n".join(retrieved_chunks))
+    
+    return "\n---\n".join(context_parts) if context_parts else "No relevant context was found in the textbook."
+
+async def stream_gemini_answer(context: str, query: str, selected_text: str | None):
+    """
+    Yields ("token", text) pieces as Gemini streams them. If the stream is blocked, fails or
+    exceeds GENERATE_TIMEOUT_S (even partway through), yields a single ("fallback", answer).
+    Streams share the generation circuit breaker but are not hedged.
+    """
+    breaker = generate_guard.breaker
+    if not breaker.allow():
+        logger.warning("Generation circuit is open. Serving the fallback answer.")
+        FALLBACKS.labels("generation_circuit_open").inc()
+        with stage_timer("fallback"):
+            answer = generate_fallback_answer(context, query)
+        yield "fallback", answer
+        return
+    prompt = build_prompt(context, query, selected_text)
+    logger.info("Attempting to stream answer from Gemini.")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + GENERATE_TIMEOUT_S
+    streamed_tokens = 0
+    try:
+        response = await asyncio.wait_for(
+            generative_model.generate_content_async(prompt, safety_settings=SAFETY_SETTINGS, stream=True),
+            timeout=GENERATE_TIMEOUT_S,
+        )
+        chunks = response.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(0.0, deadline - loop.time()))
+            except StopAsyncIteration:
+                break
+            if chunk.prompt_feedback.block_reason:
+                breaker.record_success()
+                logger.error(f"Prompt was blocked by Gemini: {chunk.prompt_feedback.block_reason}")
+                FALLBACKS.labels("generation_blocked").inc()
+                with stage_timer("fallback"):
+                    answer = generate_fallback_answer(context, query)
+                yield "fallback", answer
+                return
+            if chunk.text:
+                streamed_tokens += 1
+                yield "token", chunk.text
+        breaker.record_success()
+        logger.info("Successfully streamed answer from Gemini.")
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away; that says nothing about Gemini's health.
+        breaker.release()
+        raise
+    except Exception as e:
+        breaker.record_failure()
+        logger.error(f"Gemini streaming failed after {streamed_tokens} chunks: {e!r}", exc_info=True)
+        FALLBACKS.labels("generation_timeout" if isinstance(e, asyncio.TimeoutError) else "generation_error").inc()
+        with stage_timer("fallback"):
+            answer = generate_fallback_answer(context, query)
+        yield "fallback", answer
+
+def hit_sources(search_result) -> list[dict]:
+    """Summarizes retrieved chunks for clients: where each came from and how well it matched."""
+    return [
+        {
+            "id": str(hit.id),
+            "source": hit.payload.get("source"),
+            "chunk_index": hit.payload.get("chunk_index"),
+            "score": hit.score,
+        }
+        for hit in search_result
+        if hit.payload
+    ]
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def fuse_candidates(dense_result, lexical_result):
+    """Combines dense hits (None if the query could not be embedded) and keyword hits into context candidates."""
+    if dense_result is None:
+        logger.info(f"Using {len(lexical_result)} keyword search results only.")
+        return lexical_result[:CONTEXT_CANDIDATES]
+    if not lexical_result:
+        return dense_result[:CONTEXT_CANDIDATES]
+    return reciprocal_rank_fusion([dense_result[:HYBRID_CANDIDATES], lexical_result], limit=CONTEXT_CANDIDATES, k=RRF_K)
+
+def pack_candidates(candidates, selected_text: str | None):
+    """Picks diverse, non-overlapping chunks within the token budget and constructs the context."""
+    search_result, passages = pack_context(candidates)
+    final_context = build_context(passages, selected_text)
+    logger.info(f"Packed {len(search_result)} of {len(candidates)} candidates into {len(passages)} passages.")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Final context for generation:\n{final_context[:500]}...")
+    return search_result, final_context
+
+async def retrieve_context(search_query: SearchQuery):
+    """Runs the retrieval half of the pipeline (embed, search, build context)."""
+    # 1. Generate embedding for the query
+    search_text = search_query.search_text
+    logger.info("Generating embedding for the query.")
+    with stage_timer("embed"):
+        query_embedding = await get_embedding(search_text)
+
+    # 2. Search the vector index and the keyword index, fusing both rankings
+    with stage_timer("retrieve"):
+        lexical_result = keyword_index.search(search_text, limit=HYBRID_CANDIDATES)
+        dense_result = None
+        if query_embedding is not None:
+            limit = HYBRID_CANDIDATES if lexical_result else CONTEXT_CANDIDATES
+            dense_result = await retrieve(query_embedding, limit=limit, with_vectors=True)
+        candidates = fuse_candidates(dense_result, lexical_result)
+
+    # 3. Pick diverse, non-overlapping chunks within the token budget and construct the context
+    with stage_timer("context"):
+        search_result, final_context = pack_candidates(candidates, search_query.selected_text)
+    return query_embedding, search_result, final_context
+
+async def get_embeddings(texts: list[str]) -> list[list[float] | None]:
+    """
+    Batch counterpart of `get_embedding`: cache hits are reused and the misses are embedded
+    EMBED_BATCH_SIZE at a time. Texts whose batch failed (or while the circuit is open) get None.
+    """
+    embeddings = [await embedding_cache.get(text) for text in texts]
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+    embedded = {}
+    for i in range(0, len(missing), EMBED_BATCH_SIZE):
+        batch = missing[i:i + EMBED_BATCH_SIZE]
+        try:
+            vectors = await embedding_batcher.embed_many(batch)
+        except Exception as e:
+            logger.error(f"Failed to embed a batch of {len(batch)} queries: {e!r}. Falling back to keyword search.")
+            FALLBACKS.labels("embedding_circuit_open" if isinstance(e, CircuitOpenError) else "keyword_search").inc(len(batch))
+            continue
+        for text, vector in zip(batch, vectors):
+            embedded[text] = vector
+            await embedding_cache.put(text, vector)
+    return [embedding if embedding is not None else embedded.get(text) for text, embedding in zip(texts, embeddings)]
+
+async def retrieve_batch(query_embeddings: list, limit: int):
+    """Dense search for many embeddings, RETRIEVE_BATCH_SIZE per round trip. Returns None for missing embeddings."""
+    positions = [i for i, embedding in enumerate(query_embeddings) if embedding is not None]
+    results = [None] * len(query_embeddings)
+    for i in range(0, len(positions), RETRIEVE_BATCH_SIZE):
+        batch = positions[i:i + RETRIEVE_BATCH_SIZE]
+        try:
+            hits = await asyncio.wait_for(
+                retriever.search_batch([query_embeddings[p] for p in batch], limit, with_vectors=True),
+                timeout=RETRIEVE_TIMEOUT_S,
+            )
+        except asyncio.TimeoutError:
+            logger.error(f"Batch vector search timed out after {RETRIEVE_TIMEOUT_S}s.")
+            raise HTTPException(status_code=504, detail="Searching the book took too long. Please try again.")
+        except Exception as e:
+            logger.error(f"Batch vector search failed: {e}", exc_info=True)
+            raise search_error(e)
+        for position, result in zip(batch, hits):
+            results[position] = result
+    return results
+
+def chunk_ids(search_result) -> list[str]:
+    return [str(hit.id) for hit in search_result]
+
+async def answer_from_context(search_query: SearchQuery, query_embedding, search_result, final_context: str) -> str:
+    """Answers from the semantic answer cache if possible, otherwise with Gemini (or the fallback)."""
+    ids = chunk_ids(search_result)
+    answer = answer_cache.lookup(query_embedding, ids, search_query.selected_text)
+    if answer is not None:
+        logger.info("Serving answer from the semantic answer cache.")
+        return answer
+
+    with stage_timer("generate"):
+        answer = await request_gemini_answer(final_context, search_query.query, search_query.selected_text)
+    if answer is None:
+        with stage_timer("fallback"):
+            return generate_fallback_answer(final_context, search_query.query)
+    answer_cache.store(search_query.query, query_embedding, ids, search_query.selected_text, answer)
+    return answer
 
 # --- API Endpoints ---
-@app.post("/signin")
-def signin(user_login: UserLogin, db: Session = Depends(get_db)):
-    user = authenticate_user(db, user_login.email, user_login.password)
-    if not user:
-        raise HTTPException(status_code=401, detail="Incorrect email or password")
+def password_busy(endpoint: str) -> HTTPException:
+    logger.warning("No free password hashing worker; rejecting request.")
+    REJECTED_REQUESTS.labels(endpoint).inc()
+    return HTTPException(status_code=503, detail="Too many sign-ins right now. Please try again in a moment.")
+
+def session_response(user) -> dict:
     return {
-        "message": "Logged in successfully",
+        "token": create_session_token(user),
         "user": {
             "email": user.email,
             "background": user.background,
-        }
+        },
     }
 
+async def current_session(credentials: HTTPAuthorizationCredentials | None = Depends(HTTPBearer(auto_error=False))) -> dict:
+    """Resolves `Authorization: Bearer <token>` to the session's claims without touching the database."""
+    claims = verify_session_token(credentials.credentials) if credentials else None
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Not signed in or session expired", headers={"WWW-Authenticate": "Bearer"})
+    return claims
+
+@app.post("/signin")
+async def signin(user_login: UserLogin, db: Session = Depends(get_db)):
+    """Checks the password once (in the hashing pool) and returns a session token for later requests."""
+    try:
+        user = await authenticate_user(db, user_login.email, user_login.password)
+    except asyncio.TimeoutError:
+        raise password_busy("/signin")
+    if not user:
+        raise HTTPException(status_code=401, detail="Incorrect email or password")
+    return {"message": "Logged in successfully", **session_response(user)}
+
 @app.post("/signup")
-def signup(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def signup(user: UserCreate, db: Session = Depends(get_db)):
+    db_user = await asyncio.to_thread(get_user_by_email, db, user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    create_user(db=db, email=user.email, password=user.password, background=user.background)
-    return {"message": "User created successfully"}
+    try:
+        db_user = await create_user(db=db, email=user.email, password=user.password, background=user.background)
+    except asyncio.TimeoutError:
+        raise password_busy("/signup")
+    except IntegrityError:
+        # Another request registered the same email while this one was hashing.
+        await asyncio.to_thread(db.rollback)
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return {"message": "User created successfully", **session_response(db_user)}
+
+@app.get("/session")
+async def session(claims: dict = Depends(current_session)):
+    """Returns the signed-in user from their session token."""
+    return {"user": {"email": claims["email"], "background": claims["background"]}}
 
 @app.post("/logout")
 def logout():
     return {"message": "Logged out successfully"}
 
-@app.post("/search")
+@app.post("/search", dependencies=[Depends(require_clients)])
 async def search(search_query: SearchQuery):
     """
     Performs a RAG search: embeds query, searches Qdrant, and generates a final answer with Gemini.
+    All network calls are awaited, so one worker serves many searches concurrently.
     """
     logger.info(f"Received search query: '{search_query.query}'")
     if not search_query.query or not search_query.query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty.")
 
-    # 1. Generate embedding for the query
-    search_text = f"{search_query.query} {search_query.selected_text or ''}".strip()
-    logger.info(f"Generating embedding for text: '{search_text}'")
-    query_embedding = get_embedding(search_text)
+    async with search_slot("/search"):
+        query_embedding, search_result, final_context = await retrieve_context(search_query)
+
+        # 4. Generate final answer with Gemini (or reuse a cached answer to a near-duplicate question)
+        answer = await answer_from_context(search_query, query_embedding, search_result, final_context)
 
-    # 2. Search Qdrant using query_points to bypass the fastembed mixin
+    logger.info("Answer generation complete.")
+    return {"answer": answer}
+
+@app.post("/search/stream", dependencies=[Depends(require_clients)])
+async def search_stream(search_query: SearchQuery):
+    """
+    Streaming variant of /search using Server-Sent Events. Emits a `sources` event as soon as
+    retrieval is done, then `token` events as Gemini generates, then `done`. If generation fails
+    at any point a `fallback` event carries the fallback answer, which replaces any partial text.
+    """
+    logger.info(f"Received streaming search query: '{search_query.query}'")
+    if not search_query.query or not search_query.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty.")
+
+    # The slot is held until the stream finishes (or the client disconnects).
+    slot = AsyncExitStack()
+    await slot.enter_async_context(search_slot("/search/stream"))
     try:
-        # Using the recommended query_points method with a vector
-        query_result = qdrant_client.query_points(
-            collection_name=QDRANT_COLLECTION_NAME,
-            query=query_embedding, # Changed from query_vector to query
-            limit=5,
-            with_payload=True,
-        )
-        # Access the .points attribute from the result
-        search_result = query_result.points
-        logger.info(f"Found {len(search_result)} results from Qdrant.")
-    except Exception as e:
-        logger.error(f"Qdrant query_points failed: {e}", exc_info=True)
-        error_message = str(e).lower()
-        if "not found" in error_message or "not exist" in error_message:
-            detail = "Chatbot Error: The book content has not been indexed. Please run the `python ingest.py` script in the `src/rag-backend` directory to set up the database."
-            raise HTTPException(status_code=500, detail=detail)
-        else:
-            detail = f"Failed to search for context in database. Please check your Qdrant connection and ensure the server is running."
-            raise HTTPException(status_code=500, detail=detail)
-
-    # 3. Construct context from the search results
-    context_parts = []
-    if search_query.selected_text:
-        context_parts.append(f"User highlighted text: {search_query.selected_text}")
+        query_embedding, search_result, final_context = await retrieve_context(search_query)
+    except BaseException:
+        await slot.aclose()
+        raise
+
+    async def event_stream():
+        try:
+            yield format_sse("sources", hit_sources(search_result))
+            cached = answer_cache.lookup(query_embedding, chunk_ids(search_result), search_query.selected_text)
+            if cached is not None:
+                logger.info("Serving answer from the semantic answer cache.")
+                yield format_sse("token", {"text": cached})
+            else:
+                pieces, fell_back = [], False
+                start = time.perf_counter()
+                async for event, text in stream_gemini_answer(final_context, search_query.query, search_query.selected_text):
+                    if not pieces:
+                        STAGE_DURATION.labels("generate_first_token").observe(time.perf_counter() - start)
+                    pieces.append(text)
+                    fell_back = fell_back or event == "fallback"
+                    yield format_sse(event, {"text": text})
+                STAGE_DURATION.labels("generate").observe(time.perf_counter() - start)
+                if not fell_back:
+                    answer_cache.store(
+                        search_query.query, query_embedding, chunk_ids(search_result),
+                        search_query.selected_text, "".join(pieces),
+                    )
+            yield format_sse("done", {})
+            logger.info("Answer streaming complete.")
+        finally:
+            await slot.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.aclose),
+    )
+
+@app.post("/search/batch", dependencies=[Depends(require_clients)])
+async def search_batch(search_queries: list[SearchQuery]):
+    """
+    Answers many queries in one request, for offline and bulk jobs. All queries are embedded in
+    batched calls and searched with batched index queries up front; answers are then generated
+    SEARCH_BATCH_GENERATE_CONCURRENCY at a time and streamed back as NDJSON, one line per query
+    in input order: {"index", "answer", "sources"} or {"index", "error"}.
+    The batch holds one search slot while it embeds and retrieves, and each generation takes its
+    own slot, so its generations count against SEARCH_MAX_CONCURRENCY and the in-flight gauge.
+    """
+    logger.info(f"Received batch of {len(search_queries)} search queries.")
+    if not search_queries:
+        raise HTTPException(status_code=400, detail="The batch must contain at least one query.")
+    if len(search_queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"A batch can contain at most {SEARCH_BATCH_MAX_QUERIES} queries.")
+
+    async with search_slot("/search/batch"):
+        valid = [i for i, search_query in enumerate(search_queries) if search_query.query and search_query.query.strip()]
+        texts = [search_queries[i].search_text for i in valid]
+        with stage_timer("batch_embed"):
+            query_embeddings = await get_embeddings(texts)
+        with stage_timer("batch_retrieve"):
+            lexical_results = [keyword_index.search(text, limit=HYBRID_CANDIDATES) for text in texts]
+            dense_results = await retrieve_batch(query_embeddings, limit=max(HYBRID_CANDIDATES, CONTEXT_CANDIDATES))
+        with stage_timer("batch_context"):
+            contexts = {
+                i: (embedding, *pack_candidates(fuse_candidates(dense, lexical), search_queries[i].selected_text))
+                for i, embedding, dense, lexical in zip(valid, query_embeddings, dense_results, lexical_results)
+            }
 
-    retrieved_chunks = [hit.payload.get("page_content", "") for hit in search_result if hit.payload]
-    retrieved_chunks = [chunk for chunk in retrieved_chunks if chunk]
+    generate_slots = asyncio.Semaphore(SEARCH_BATCH_GENERATE_CONCURRENCY)
+
+    async def answer(i: int) -> dict:
+        if i not in contexts:
+            return {"index": i, "error": "Query cannot be empty."}
+        query_embedding, search_result, final_context = contexts[i]
+        # Bulk jobs wait for a slot rather than failing with 503 like an interactive search.
+        async with generate_slots, search_slot("/search/batch", timeout_s=None):
+            answer = await answer_from_context(search_queries[i], query_embedding, search_result, final_context)
+        return {"index": i, "answer": answer, "sources": hit_sources(search_result)}
+
+    async def result_lines():
+        tasks = [asyncio.ensure_future(answer(i)) for i in range(len(search_queries))]
+        try:
+            for task in tasks:
+                yield json.dumps(await task) + "\n"
+            logger.info("Batch search complete.")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+@app.get("/stats", dependencies=[Depends(require_clients)])
+def stats():
+    return {
+        "query_embeddings": embedding_cache.stats(),
+        "query_embedding_batches": embedding_batcher.stats(),
+        "answers": answer_cache.stats(),
+        "circuits": {"embed": embed_guard.stats(), "generate": generate_guard.stats()},
+    }
 
-    if retrieved_chunks:
-        context_parts.append("Relevant content from the book:\n" + "\n\n".join(retrieved_chunks))
-    
-    final_context = "\n---\n".join(context_parts) if context_parts else "No relevant context was found in the textbook."
-    logger.info(f"Final context for generation:\n{final_context[:500]}...")
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, fallback/error counters, in-flight gauges."""
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
 
-    # 4. Generate final answer with Gemini
-    answer = generate_gemini_answer(final_context, search_query.query, search_query.selected_text)
-    
-    logger.info("Answer generation complete.")
-    return {"answer": answer}
+@app.get("/healthz")
+def healthz():
+    """Liveness: answers as long as the worker is serving, with the last known state of each dependency."""
+    return {
+        "status": "ok",
+        "clients_ready": clients_ready,
+        "warmed_up": warmed_up,
+        "dependencies": dependency_status,
+        "circuits": {"embed": embed_guard.breaker.state, "generate": generate_guard.breaker.state},
+    }
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: 200 once warm-up is done and the vector index and database answer, 503 otherwise.
+    A failed vector index check is retried here (with a short deadline) so the worker recovers on its own.
+    Gemini is reported but not required: searches fall back to keyword search and context-only answers.
+    """
+    if warmed_up and not dependency_status["vector_index"]["ok"]:
+        await check_dependency("vector_index", retriever.warm_up, timeout_s=READY_CHECK_TIMEOUT_S)
+    ready = warmed_up and all(dependency_status[name]["ok"] for name in ("vector_index", "database"))
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "warmed_up": warmed_up,
+            "dependencies": dependency_status,
+            "circuits": {"embed": embed_guard.breaker.state, "generate": generate_guard.breaker.state},
+        },
+    )
 
 @app.get("/")
 def read_root():
@@ -214,28 +783,25 @@ def read_root():
 
 # This must come AFTER all API routes
 # Frontend build directory
-FRONTEND_BUILD_DIR = Path(__file__).parent.parent.parent / "build"
+FRONTEND_BUILD_DIR = Path(os.getenv("FRONTEND_BUILD_DIR", Path(__file__).parent.parent.parent / "build"))
 logger.info(f"Resolved FRONTEND_BUILD_DIR: {FRONTEND_BUILD_DIR}")
 logger.info(f"FRONTEND_BUILD_DIR exists: {FRONTEND_BUILD_DIR.exists()}")
 
-if not FRONTEND_BUILD_DIR.exists():
-    logger.error(f"Frontend build directory not found: {FRONTEND_BUILD_DIR}. Ensure 'npm run build' has been executed in the Docusaurus project root.")
-    raise RuntimeError("Docusaurus build directory not found. Please run 'npm run build'.") # Make it explicit
-
-# Mount the entire Docusaurus build directory at the root "/"
-# This serves all static files (JS, CSS, images, etc.) that Docusaurus generates
-# It should be placed before the catch-all for index.html, but after API routes.
-app.mount("/", StaticFiles(directory=FRONTEND_BUILD_DIR), name="docusaurus_static")
-
-# This route specifically serves the root index.html for Docusaurus if app.mount didn't catch it
-# or for dynamic routes.
-# It MUST be placed AFTER app.mount and AFTER all API endpoints.
-@app.get("/{full_path:path}")
-async def serve_spa(full_path: str):
-    index_file_path = FRONTEND_BUILD_DIR / "index.html"
-    if index_file_path.is_file():
-        return FileResponse(index_file_path)
-    raise HTTPException(status_code=404, detail="Frontend index.html not found in build directory.")
-
-
-
+if FRONTEND_BUILD_DIR.exists():
+    # Indexed on startup (see lifespan); serves precompressed variants, ETags/304s and keeps small files in memory.
+    static_site = StaticSite(FRONTEND_BUILD_DIR)
+else:
+    # The API still works without the frontend (e.g. when the book is hosted elsewhere).
+    static_site = None
+    logger.warning(f"Frontend build directory not found: {FRONTEND_BUILD_DIR}. Run 'npm run build' in the Docusaurus project root to serve the book from this app.")
+
+# Serves the Docusaurus build: files, their directory index.html pages and, for client-side
+# routes, the root index.html. It MUST be placed AFTER all API endpoints.
+@app.api_route("/{full_path:path}", methods=["GET", "HEAD"])
+async def serve_spa(full_path: str, request: Request):
+    response = None
+    if static_site is not None:
+        response = static_site.response(full_path, request.headers, head=request.method == "HEAD")
+    if response is None:
+        raise HTTPException(status_code=404, detail="Frontend index.html not found in build directory.")
+    return response
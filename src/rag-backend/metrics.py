@@ -0,0 +1,86 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    push_to_gateway,
+    write_to_textfile,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Set to expose metrics from every uvicorn worker (see prometheus_client's multiprocess mode).
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Where index_book.py writes its metrics after a run (node_exporter textfile collector format).
+INDEX_METRICS_PATH = os.getenv("INDEX_METRICS_PATH", os.path.join(os.path.dirname(__file__), "index_metrics.prom"))
+# Optional Pushgateway address for index_book.py runs, e.g. "localhost:9091".
+PROMETHEUS_PUSHGATEWAY = os.getenv("PROMETHEUS_PUSHGATEWAY")
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+STAGE_DURATION = Histogram(
+    "rag_stage_duration_seconds", "Time spent in each pipeline stage.", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stages that raised an exception.", ["stage"])
+FALLBACKS = Counter("rag_fallbacks_total", "Requests served by a fallback path.", ["reason"])
+REQUESTS_IN_FLIGHT = Gauge(
+    "rag_requests_in_flight", "Search requests currently holding a search slot.", ["endpoint"],
+    multiprocess_mode="livesum",
+)
+REJECTED_REQUESTS = Counter("rag_rejected_requests_total", "Requests rejected with 503 (no free search slot or password hashing worker).", ["endpoint"])
+EMBEDDING_RETRIES = Counter("rag_embedding_retries_total", "Embedding batches retried after a transient error.")
+INDEXED_CHUNKS = Counter("rag_index_chunks_total", "Chunks processed by indexing runs.", ["action"])
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Records the duration of a pipeline stage, and counts it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - start)
+
+
+class StatsCollector:
+    """Exports the numeric values of `stats()` dicts (caches, batcher, ...) as gauges."""
+
+    def __init__(self, sources):
+        self.sources = sources  # {metric prefix: callable returning a flat-ish dict}
+
+    def collect(self):
+        for prefix, stats in self.sources.items():
+            for key, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield GaugeMetricFamily(f"rag_{prefix}_{key}", f"{prefix} {key.replace('_', ' ')}.", value=value)
+
+
+def register_stats(sources):
+    REGISTRY.register(StatsCollector(sources))
+
+
+def render_latest():
+    """Returns (body, content type) for a Prometheus scrape of this process (or all workers)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def export_run_metrics(job: str):
+    """Writes this process's metrics to INDEX_METRICS_PATH and, if configured, pushes them to a Pushgateway."""
+    write_to_textfile(INDEX_METRICS_PATH, REGISTRY)
+    if PROMETHEUS_PUSHGATEWAY:
+        push_to_gateway(PROMETHEUS_PUSHGATEWAY, job=job, registry=REGISTRY)
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Parsed/chunked files, one JSON entry per (file, chunker settings). Safe to delete at any time.
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", os.path.join(os.path.dirname(__file__), "parse_cache"))
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+
+def _file_hash(file_path: str) -> str:
+    with open(file_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ParseCache:
+    """
+    On-disk cache of parse/chunk results keyed by file path, mtime, content hash and chunker settings.
+
+    A matching mtime is trusted as-is; otherwise the content hash is compared, so a file that was
+    touched but not changed (e.g. by a fresh checkout) is still a hit.
+    """
+
+    def __init__(self, settings: dict, path: str = PARSE_CACHE_DIR):
+        self.settings = settings
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, file_path: str) -> str:
+        key = json.dumps([os.path.abspath(file_path), self.settings], sort_keys=True)
+        return os.path.join(self.path, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, file_path: str):
+        """Returns the cached chunks for `file_path`, or None on a miss."""
+        try:
+            with open(self._entry_path(file_path), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            mtime_ns = os.stat(file_path).st_mtime_ns
+        except (OSError, ValueError):
+            return None
+        if entry.get("settings") != self.settings:
+            return None
+        if entry.get("mtime_ns") != mtime_ns:
+            if entry.get("content_hash") != _file_hash(file_path):
+                return None
+            entry["mtime_ns"] = mtime_ns
+            self._write(file_path, entry)
+        return entry["chunks"]
+
+    def put(self, file_path: str, chunks, mtime_ns: int, file_hash: str):
+        self._write(file_path, {
+            "path": os.path.abspath(file_path),
+            "mtime_ns": mtime_ns,
+            "content_hash": file_hash,
+            "settings": self.settings,
+            "chunks": chunks,
+        })
+
+    def _write(self, file_path: str, entry: dict):
+        os.makedirs(self.path, exist_ok=True)
+        entry_path = self._entry_path(file_path)
+        tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, entry_path)
+
+
+def _parse_one(parse_fn, file_path: str, settings: dict):
+    # Stat and hash before parsing, so an edit made while parsing is picked up by the next run.
+    mtime_ns = os.stat(file_path).st_mtime_ns
+    file_hash = _file_hash(file_path)
+    return parse_fn(file_path, settings), mtime_ns, file_hash
+
+
+def parse_files(paths, parse_fn, settings: dict, workers: int = PARSE_WORKERS, cache_dir: str = PARSE_CACHE_DIR):
+    """
+    Yields (path, chunks) for each path, in order. Cached files are served from `cache_dir`;
+    the rest are parsed with `parse_fn(path, settings)` across a pool of `workers` processes,
+    keeping at most 2 * workers files in flight. `parse_fn` must be a picklable module-level
+    function that returns JSON-serializable chunks.
+    """
+    cache = ParseCache(settings, cache_dir)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()  # (path, cached chunks or future)
+
+    def drain():
+        path, result = pending.popleft()
+        if not isinstance(result, list):
+            chunks, mtime_ns, file_hash = result.result() if pool else result
+            cache.put(path, chunks, mtime_ns, file_hash)
+            result = chunks
+        return path, result
+
+    try:
+        for path in paths:
+            chunks = cache.get(path)
+            if chunks is not None:
+                cache.hits += 1
+                pending.append((path, chunks))
+            else:
+                cache.misses += 1
+                if pool:
+                    pending.append((path, pool.submit(_parse_one, parse_fn, path, settings)))
+                else:
+                    pending.append((path, _parse_one(parse_fn, path, settings)))
+            while len(pending) > 2 * max(workers, 1):
+                yield drain()
+        while pending:
+            yield drain()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        if cache.hits or cache.misses:
+            print(f"Parse cache: {cache.hits} files reused, {cache.misses} parsed.")
@@ -0,0 +1,62 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+# bcrypt costs ~250 ms of CPU per hash or check, so it runs in worker processes, never on the event loop.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_TIMEOUT_S = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT_S", "5"))  # max wait for a free worker
+# The pool starts on the first sign-in, when the app worker already runs threads (asyncio's
+# to_thread pool, gRPC); forking it then can deadlock the children, so workers come from a forkserver.
+PASSWORD_HASH_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+_pool = None
+_slots = None
+
+
+def get_password_hash(password):
+    # Truncate password to 72 bytes, as bcrypt has a limitation for longer passwords.
+    # It's important to note this limitation and potentially inform the user on the frontend.
+    truncated_password = password.encode('utf-8')[:72].decode('utf-8', 'ignore')
+    return pwd_context.hash(truncated_password)
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+async def _run(fn, *args):
+    """
+    Runs `fn` in the hashing pool. At most PASSWORD_HASH_WORKERS calls run at once per app worker;
+    the rest wait here and get asyncio.TimeoutError after PASSWORD_HASH_QUEUE_TIMEOUT_S.
+    """
+    global _pool, _slots
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context(PASSWORD_HASH_START_METHOD)
+        )
+        _slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+    await asyncio.wait_for(_slots.acquire(), timeout=PASSWORD_HASH_QUEUE_TIMEOUT_S)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_pool, fn, *args)
+    finally:
+        _slots.release()
+
+
+async def hash_password(password: str) -> str:
+    return await _run(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run(verify_password, plain_password, hashed_password)
+
+
+def shutdown():
+    global _pool, _slots
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = _slots = None
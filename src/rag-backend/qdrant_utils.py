@@ -4,23 +4,40 @@ import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 
+from embedding_pipeline import EmbeddingPipeline
+from collection_aliases import create_version, pending_version, publish_version
+from config import EMBEDDING_MODEL, point_vector, vectors_config
+from retrievers import query_kwargs
+
 load_dotenv()
 
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") # Add this line to access GEMINI_API_KEY
-COLLECTION_NAME = "ai_book" # Changed collection name to 'ai_book'
+COLLECTION_NAME = "ai_book" # Changed collection name to 'ai_book'; an alias to the live collection version
 
 genai.configure(api_key=GEMINI_API_KEY) # Configure genai here
 
 class QdrantManager:
     def __init__(self):
-        self.client = qdrant_client.QdrantClient(
-            url=QDRANT_URL, 
-            api_key=QDRANT_API_KEY,
-        )
-        self.embedding_model = "models/text-embedding-004"
-        self.collection_name = COLLECTION_NAME
+        self._client = None
+        self.embedding_model = EMBEDDING_MODEL
+        self.collection_name = COLLECTION_NAME  # where upserts go; a new version while one is being built
+        self.pipeline = EmbeddingPipeline(model=self.embedding_model, task_type="RETRIEVAL_DOCUMENT")
+
+    @property
+    def client(self):
+        """Created on first use, so importing this module does not set up a connection."""
+        if self._client is None:
+            self._client = qdrant_client.QdrantClient(
+                url=QDRANT_URL,
+                api_key=QDRANT_API_KEY,
+            )
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
 
     def _get_embedding_vector(self, text: str):
         response = genai.embed_content(
@@ -31,33 +48,61 @@ class QdrantManager:
         return response['embedding']
 
     def create_collection(self):
-        # The embedding size for models/text-embedding-004 is 768
-        self.client.recreate_collection(
-            collection_name=self.collection_name,
-            vectors_config=qdrant_client.http.models.VectorParams(
-                size=768, # Correct size for models/text-embedding-004
-                distance=qdrant_client.http.models.Distance.COSINE
-            )
+        """
+        Starts a new versioned collection behind the alias, or resumes one an earlier run left
+        unpublished (if it has the same vector settings); upserts go there until
+        `publish_collection` switches the alias, so the live collection keeps serving meanwhile.
+        """
+        pending = pending_version(self.client, COLLECTION_NAME)
+        if pending is not None and self.client.get_collection(pending).config.params.vectors == vectors_config():
+            self.collection_name = pending
+        else:
+            self.collection_name = create_version(self.client, COLLECTION_NAME, vectors_config())
+        return self.collection_name
+
+    def publish_collection(self, expected_points: int):
+        """Checks the new version's point count and atomically switches the alias to it."""
+        try:
+            publish_version(self.client, COLLECTION_NAME, self.collection_name, expected_points)
+        except RuntimeError:
+            self.client.delete_collection(collection_name=self.collection_name)
+            raise
+        finally:
+            self.collection_name = COLLECTION_NAME
+
+    def leave_unpublished(self):
+        """Stops upserting into the new version without publishing it, so the next run can resume it."""
+        name, self.collection_name = self.collection_name, COLLECTION_NAME
+        return name
+
+    def existing_ids(self, ids):
+        """Returns the subset of `ids` already stored in the collection upserts go to."""
+        records = self.client.retrieve(
+            collection_name=self.collection_name, ids=list(ids), with_payload=False, with_vectors=False
         )
+        return {str(record.id) for record in records}
+
+    def embed_documents(self, ids, documents):
+        """
+        Embeds documents with batched, retrying calls. Returns {id: vector}; documents that still
+        fail are left out and recorded in the embedding pipeline's failed batches file.
+        """
+        return self.pipeline.embed(list(zip(ids, documents)))
 
-    def upsert_documents(self, documents, metadatas):
+    def upsert_points(self, ids, vectors, payloads):
+        """Upserts one batch of points, waiting for Qdrant to apply it so callers get backpressure."""
         self.client.upsert(
             collection_name=self.collection_name,
-            points=qdrant_client.http.models.Batch(
-                ids=None, # Auto-generate IDs
-                vectors=[self._get_embedding_vector(doc) for doc in documents],
-                payloads=metadatas
-            )
+            points=[
+                qdrant_client.http.models.PointStruct(id=point_id, vector=point_vector(vector), payload=payload)
+                for point_id, vector, payload in zip(ids, vectors, payloads)
+            ],
+            wait=True,
         )
 
     def search(self, query: str, limit: int = 5):
         vector = self._get_embedding_vector(query)
-        hits = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=vector,
-            limit=limit,
-            with_payload=True
-        )
-        return hits
+        hits = self.client.query_points(collection_name=COLLECTION_NAME, **query_kwargs(vector, limit))
+        return hits.points
 
 qdrant_manager = QdrantManager()
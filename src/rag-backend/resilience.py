@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # consecutive failures before opening
+CIRCUIT_RESET_TIMEOUT_S = float(os.getenv("CIRCUIT_RESET_TIMEOUT_S", "30"))  # cool-down before half-open probes
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))  # probes allowed at once when half-open
+# Send a second, identical request when the first is still running after the rolling p95 latency.
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+HEDGE_MIN_SAMPLES = 20  # latencies needed before the p95 is trusted
+LATENCY_WINDOW = 200
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and consecutive failures are counted. After `failure_threshold`
+    failures the circuit opens and calls are rejected until `reset_timeout_s` has passed; then it
+    is half-open and lets `half_open_probes` calls through. A successful probe closes it again,
+    a failed one re-opens it for another cool-down.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout_s: float = CIRCUIT_RESET_TIMEOUT_S,
+        half_open_probes: int = CIRCUIT_HALF_OPEN_PROBES,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go through now. Every allowed call must end in `record_*` or `release`."""
+        if self.state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout_s:
+            self.state = self.HALF_OPEN
+            self.probes_in_flight = 0
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and self.probes_in_flight < self.half_open_probes:
+            self.probes_in_flight += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self):
+        """Ends an allowed call without a verdict (e.g. it was cancelled)."""
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probes_in_flight = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+            self.probes_in_flight = 0
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "open": int(self.state == self.OPEN),
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def hedged(factory, timeout: float, hedge_after: float | None = None):
+    """
+    Awaits `factory()` with a deadline of `timeout` seconds. If `hedge_after` is set and the first
+    attempt is still running by then, a second attempt is started and whichever succeeds first wins
+    (the other is cancelled). Returns (result, whether a second attempt was started).
+    """
+    started = []
+
+    async def race():
+        pending = {asyncio.ensure_future(factory())}
+        started.extend(pending)
+        try:
+            if hedge_after is not None and hedge_after < timeout:
+                done, _ = await asyncio.wait(pending, timeout=hedge_after)
+                if not done:
+                    second = asyncio.ensure_future(factory())
+                    started.append(second)
+                    pending.add(second)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in started:
+                task.cancel()
+
+    result = await asyncio.wait_for(race(), timeout=timeout)
+    return result, len(started) > 1
+
+
+class Guard:
+    """
+    Runs calls to one dependency through a circuit breaker, a deadline and (optionally) a hedged
+    second attempt once the call is slower than the dependency's recent p95 latency.
+    """
+
+    def __init__(self, name: str, timeout_s: float, hedge: bool = HEDGE_REQUESTS, breaker: CircuitBreaker | None = None):
+        self.name = name
+        self.timeout_s = timeout_s
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latency = LatencyTracker()
+        self.hedged = 0
+
+    def hedge_after(self):
+        if not self.hedge or len(self.latency.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return self.latency.quantile(0.95)
+
+    async def call(self, factory):
+        """
+        Returns `await factory()`. Raises CircuitOpenError right away while the circuit is open,
+        asyncio.TimeoutError after `timeout_s`, or the call's own error.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        start = time.perf_counter()
+        try:
+            result, was_hedged = await hedged(factory, self.timeout_s, self.hedge_after())
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self.latency.observe(time.perf_counter() - start)
+        self.hedged += was_hedged
+        return result
+
+    def stats(self) -> dict:
+        p95 = self.latency.quantile(0.95)
+        return {**self.breaker.stats(), "hedged": self.hedged, "p95_ms": p95 * 1000 if p95 is not None else 0.0}
@@ -0,0 +1,117 @@
+import math
+
+from qdrant_client import models
+
+from config import (
+    COMPACT_EMBEDDING_DIM, COMPACT_VECTOR, FULL_VECTOR, RESCORE_OVERSAMPLING, VECTOR_QUANTIZATION,
+    compact_vector, full_vector,
+)
+from local_index import LocalVectorIndex, LOCAL_INDEX_DIR
+
+
+def query_kwargs(vector, limit: int = 5, with_vectors: bool = False) -> dict:
+    """
+    Arguments for `query_points` (sync or async client). With compact vectors, a prefetch over the
+    compact (and possibly quantized) vectors picks limit * RESCORE_OVERSAMPLING candidates that are
+    rescored with the full vectors; with quantization alone, Qdrant oversamples and rescores itself.
+    """
+    kwargs = {"query": vector, "limit": limit, "with_payload": True, "with_vectors": with_vectors}
+    if COMPACT_EMBEDDING_DIM:
+        kwargs["prefetch"] = models.Prefetch(
+            query=compact_vector(vector),
+            using=COMPACT_VECTOR,
+            limit=math.ceil(limit * RESCORE_OVERSAMPLING),
+            params=models.SearchParams(quantization=models.QuantizationSearchParams(rescore=False))
+            if VECTOR_QUANTIZATION != "none" else None,
+        )
+        kwargs["using"] = FULL_VECTOR
+        kwargs["with_vectors"] = [FULL_VECTOR] if with_vectors else False
+    elif VECTOR_QUANTIZATION != "none":
+        kwargs["search_params"] = models.SearchParams(
+            quantization=models.QuantizationSearchParams(rescore=True, oversampling=RESCORE_OVERSAMPLING)
+        )
+    return kwargs
+
+
+def query_request(vector, limit: int = 5, with_vectors: bool = False):
+    """The same search as `query_kwargs`, as a request for `query_batch_points`."""
+    kwargs = query_kwargs(vector, limit, with_vectors)
+    return models.QueryRequest(
+        query=kwargs["query"],
+        using=kwargs.get("using"),
+        prefetch=kwargs.get("prefetch"),
+        params=kwargs.get("search_params"),
+        limit=kwargs["limit"],
+        with_payload=True,
+        with_vector=kwargs["with_vectors"],
+    )
+
+
+def unwrap_vectors(points):
+    """Replaces named vectors on returned points with the full embedding."""
+    for point in points:
+        if isinstance(point.vector, dict):
+            point.vector = full_vector(point.vector)
+    return points
+
+
+class QdrantRetriever:
+    """Dense retrieval against a (remote) Qdrant collection."""
+
+    def __init__(self, client, collection_name: str):
+        self.client = client
+        self.collection_name = collection_name
+
+    async def search(self, vector, limit: int = 5, with_vectors: bool = False):
+        # Using query_points to bypass the fastembed mixin
+        result = await self.client.query_points(
+            collection_name=self.collection_name, **query_kwargs(vector, limit, with_vectors)
+        )
+        return unwrap_vectors(result.points)
+
+    async def search_batch(self, vectors, limit: int = 5, with_vectors: bool = False):
+        """Runs one search per vector in a single `query_batch_points` round trip."""
+        responses = await self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[query_request(vector, limit, with_vectors) for vector in vectors],
+        )
+        return [unwrap_vectors(response.points) for response in responses]
+
+    async def warm_up(self) -> dict:
+        """Opens the connection (and TLS session) and checks the collection exists."""
+        info = await self.client.get_collection(self.collection_name)
+        return {"points": info.points_count}
+
+    async def close(self):
+        await self.client.close()
+
+
+class LocalRetriever:
+    """Dense retrieval against the in-process, memory-mapped index written by index_book.py."""
+
+    def __init__(self, path: str = LOCAL_INDEX_DIR):
+        self.path = path
+        try:
+            self.index = LocalVectorIndex.load(path)
+        except FileNotFoundError:
+            self.index = None
+
+    async def search(self, vector, limit: int = 5, with_vectors: bool = False):
+        if self.index is None:
+            raise RuntimeError(f"Local index not found at '{self.path}'. Run `python index_book.py` first.")
+        return self.index.search(vector, limit, with_vectors)
+
+    async def search_batch(self, vectors, limit: int = 5, with_vectors: bool = False):
+        if self.index is None:
+            raise RuntimeError(f"Local index not found at '{self.path}'. Run `python index_book.py` first.")
+        return self.index.search_batch(vectors, limit, with_vectors)
+
+    async def warm_up(self) -> dict:
+        """Runs one search so the memory-mapped vectors are paged in before the first request."""
+        if self.index is None:
+            raise RuntimeError(f"Local index not found at '{self.path}'. Run `python index_book.py` first.")
+        self.index.search(self.index.vectors[0], limit=1)
+        return {"points": len(self.index)}
+
+    async def close(self):
+        pass
@@ -0,0 +1,270 @@
+"""
+Serves the Docusaurus build: precompressed variants, long-lived caching of fingerprinted assets,
+ETags with 304 responses and small files (including index.html) held in memory.
+
+Large files are compressed once on disk (`<file>.br` / `<file>.gz`), either at build time:
+
+    python static_files.py ../../build
+
+or in the background when the app starts (STATIC_PRECOMPRESS_ON_STARTUP). Brotli is used when
+the `brotli` package is installed; gzip always works.
+"""
+import os
+import re
+import gzip
+import hashlib
+import logging
+import mimetypes
+import argparse
+from collections import namedtuple
+from pathlib import Path
+
+from starlette.responses import FileResponse, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_MEMORY_MAX_FILE_BYTES = int(os.getenv("STATIC_MEMORY_MAX_FILE_BYTES", str(64 * 1024)))  # larger files stream from disk
+STATIC_MEMORY_BUDGET_BYTES = int(os.getenv("STATIC_MEMORY_BUDGET_BYTES", str(32 * 1024 * 1024)))  # all in-memory bodies
+STATIC_MAX_AGE_S = int(os.getenv("STATIC_MAX_AGE_S", "3600"))  # non-fingerprinted assets (images, favicon, ...)
+STATIC_PRECOMPRESS_ON_STARTUP = os.getenv("STATIC_PRECOMPRESS_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+# Levels for files compressed in memory by the running app (brotli 11 costs ~100x more CPU than 5).
+STATIC_RUNTIME_BROTLI_QUALITY = int(os.getenv("STATIC_RUNTIME_BROTLI_QUALITY", "5"))
+STATIC_RUNTIME_GZIP_LEVEL = int(os.getenv("STATIC_RUNTIME_GZIP_LEVEL", "6"))
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_EXTENSIONS = frozenset(
+    ".html .js .mjs .css .json .map .svg .xml .txt .ico .webmanifest .ttf .otf .eot".split()
+)
+# Docusaurus (webpack) names bundles and imported images `<name>.<hash>.<ext>` or `<name>-<hash>.<ext>`.
+FINGERPRINT_PATTERN = re.compile(r"[.-][0-9a-f]{8,}\.[a-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Preferred first; `None` is the identity encoding.
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# One servable representation of a file: the bytes in memory, or a path to stream from.
+Variant = namedtuple("Variant", ["etag", "size", "body", "path"])
+
+
+def compress(data: bytes, encoding: str, runtime: bool = False) -> bytes:
+    """Maximum compression for the on-disk build step; `runtime` trades a little size for much less CPU."""
+    if encoding == "br":
+        return brotli.compress(data, quality=STATIC_RUNTIME_BROTLI_QUALITY if runtime else 11)
+    return gzip.compress(data, compresslevel=STATIC_RUNTIME_GZIP_LEVEL if runtime else 9, mtime=0)
+
+
+def available_encodings():
+    return [(encoding, suffix) for encoding, suffix in ENCODINGS if encoding != "br" or brotli is not None]
+
+
+def is_compressible(path: Path) -> bool:
+    return path.suffix.lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def is_variant_file(path: Path) -> bool:
+    """Whether `path` is a precompressed copy of another file (e.g. main.js.br next to main.js)."""
+    return path.suffix in (".br", ".gz") and path.with_suffix("").is_file()
+
+
+def precompress(build_dir, min_bytes: int = STATIC_MEMORY_MAX_FILE_BYTES) -> int:
+    """
+    Writes `.br` (if available) and `.gz` variants next to compressible files of at least
+    `min_bytes`, skipping variants that are already newer than their source. Variants that would not
+    save at least 5% are not written. Returns the number of files written.
+    """
+    written = 0
+    for path in sorted(Path(build_dir).rglob("*")):
+        if not path.is_file() or is_variant_file(path) or not is_compressible(path):
+            continue
+        stat = path.stat()
+        if stat.st_size < max(min_bytes, MIN_COMPRESS_BYTES):
+            continue
+        data = None
+        for encoding, suffix in available_encodings():
+            target = path.with_name(path.name + suffix)
+            if target.is_file() and target.stat().st_mtime_ns >= stat.st_mtime_ns:
+                continue
+            data = data if data is not None else path.read_bytes()
+            compressed = compress(data, encoding)
+            if len(compressed) > len(data) * 0.95:
+                continue
+            tmp_path = target.with_name(target.name + ".tmp")
+            tmp_path.write_bytes(compressed)
+            os.replace(tmp_path, target)
+            written += 1
+    return written
+
+
+class StaticSite:
+    """
+    The files of a static build, indexed by `load()` (fast: no compression) and then compressed by
+    `compress_in_background()` off the request path. Only indexed files are ever served, and
+    paths resolve like Docusaurus's own server: `/docs/intro` -> `docs/intro/index.html` or
+    `docs/intro.html`. Unknown extension-less paths fall back to `index.html` (client-side routes).
+    """
+
+    def __init__(self, build_dir):
+        self.build_dir = Path(build_dir)
+        self.files = {}  # relative posix path -> {"content_type", "cache_control", "variants": {encoding: Variant}}
+        self.memory_bytes = 0
+        self.loaded = False
+
+    def _cache_control(self, relative: str, content_type: str) -> str:
+        if relative.startswith("assets/") and FINGERPRINT_PATTERN.search(relative):
+            return IMMUTABLE
+        if content_type.startswith("text/html"):
+            return "no-cache"  # always revalidate, so a new deploy is picked up at once
+        return f"public, max-age={STATIC_MAX_AGE_S}"
+
+    @staticmethod
+    def _disk_variants(path: Path, stat) -> dict:
+        """Identity variant streamed from disk plus any up-to-date .br/.gz siblings."""
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        variants = {None: Variant(etag, stat.st_size, None, path)}
+        for encoding, suffix in ENCODINGS:
+            compressed = path.with_name(path.name + suffix)
+            if compressed.is_file() and compressed.stat().st_mtime_ns >= stat.st_mtime_ns:
+                variants[encoding] = Variant(etag[:-1] + f'-{suffix[1:]}"', compressed.stat().st_size, None, compressed)
+        return variants
+
+    def _variants(self, path: Path, stat, budget: int) -> dict:
+        """The identity variant of one file; small files (and index.html) are read into memory."""
+        in_memory = (stat.st_size <= STATIC_MEMORY_MAX_FILE_BYTES and stat.st_size <= budget) or path.name == "index.html"
+        if not in_memory:
+            return self._disk_variants(path, stat)
+        data = path.read_bytes()
+        return {None: Variant(f'"{hashlib.sha1(data).hexdigest()[:20]}"', len(data), data, path)}
+
+    @staticmethod
+    def _compressed_variants(variants: dict) -> dict:
+        """Adds in-memory .br/.gz encodings of an in-memory identity variant, where they save at least 5%."""
+        identity = variants[None]
+        if not is_compressible(identity.path) or identity.size < MIN_COMPRESS_BYTES:
+            return variants
+        variants = dict(variants)
+        for encoding, suffix in available_encodings():
+            compressed = compress(identity.body, encoding, runtime=True)
+            if len(compressed) <= identity.size * 0.95:
+                variants[encoding] = Variant(identity.etag[:-1] + f'-{suffix[1:]}"', len(compressed), compressed, None)
+        return variants
+
+    def load(self):
+        """(Re)builds the file index: small files are read, large files only stat'ed, nothing is compressed."""
+        files = {}
+        memory_bytes = 0
+        for path in sorted(self.build_dir.rglob("*")):
+            if not path.is_file() or is_variant_file(path) or path.name.endswith(".tmp"):
+                continue
+            relative = path.relative_to(self.build_dir).as_posix()
+            content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+                content_type += "; charset=utf-8"
+            variants = self._variants(path, path.stat(), STATIC_MEMORY_BUDGET_BYTES - memory_bytes)
+            memory_bytes += sum(variant.size for variant in variants.values() if variant.body is not None)
+            files[relative] = {
+                "content_type": content_type,
+                "cache_control": self._cache_control(relative, content_type),
+                "variants": variants,
+            }
+        self.files, self.memory_bytes, self.loaded = files, memory_bytes, True
+        logger.info(f"Indexed {len(files)} static files from {self.build_dir} ({memory_bytes / 1024:.0f} KiB in memory).")
+
+    def compress_in_background(self, precompress_on_disk: bool = STATIC_PRECOMPRESS_ON_STARTUP):
+        """
+        Runs after `load()`, in a thread: compresses the in-memory files and, if `precompress_on_disk`,
+        writes missing .br/.gz variants of large files. Entries are swapped in one at a time, so
+        requests meanwhile get the identity (or a previously compressed) variant.
+        """
+        for entry in self.files.values():
+            variants = entry["variants"]
+            if variants[None].body is not None and len(variants) == 1:
+                compressed = self._compressed_variants(variants)
+                self.memory_bytes += sum(v.size for v in compressed.values() if v.body is not None) - variants[None].size
+                entry["variants"] = compressed
+        if not precompress_on_disk:
+            return
+        try:
+            written = precompress(self.build_dir)
+        except OSError as e:
+            logger.warning(f"Could not precompress static files in {self.build_dir}: {e}")
+            return
+        if written:
+            logger.info(f"Precompressed {written} static file variants.")
+            for entry in self.files.values():
+                identity = entry["variants"][None]
+                if identity.body is None:
+                    entry["variants"] = self._disk_variants(identity.path, identity.path.stat())
+
+    def resolve(self, url_path: str) -> str | None:
+        relative = url_path.strip("/")
+        candidates = [relative, f"{relative}/index.html", f"{relative}.html"] if relative else ["index.html"]
+        for candidate in candidates:
+            if candidate in self.files:
+                return candidate
+        if "." not in relative.rsplit("/", 1)[-1]:
+            return "index.html" if "index.html" in self.files else None
+        return None
+
+    @staticmethod
+    def _accepted(accept_encoding: str) -> set:
+        accepted = set()
+        for part in accept_encoding.split(","):
+            coding, _, params = part.strip().partition(";")
+            q = params.strip()
+            try:
+                if q.startswith("q=") and float(q[2:] or 0) == 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(coding.strip().lower())
+        return accepted
+
+    @staticmethod
+    def _not_modified(if_none_match: str, etag: str) -> bool:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    def response(self, url_path: str, headers, head: bool = False) -> Response | None:
+        """The response for a GET (or, with `head`, a HEAD) of `url_path`, or None if no file matches."""
+        if not self.loaded:
+            self.load()
+        relative = self.resolve(url_path)
+        if relative is None:
+            return None
+        entry = self.files[relative]
+        variants = entry["variants"]
+        accepted = self._accepted(headers.get("accept-encoding", ""))
+        encoding = next((encoding for encoding, _ in ENCODINGS if encoding in variants and encoding in accepted), None)
+        variant = variants[encoding]
+
+        response_headers = {"etag": variant.etag, "cache-control": entry["cache_control"]}
+        if len(variants) > 1:
+            response_headers["vary"] = "Accept-Encoding"
+        if self._not_modified(headers.get("if-none-match", ""), variant.etag):
+            return Response(status_code=304, headers=response_headers)
+        if encoding is not None:
+            response_headers["content-encoding"] = encoding
+        if variant.body is not None:
+            if head:
+                response_headers["content-length"] = str(variant.size)
+            return Response(content=b"" if head else variant.body, media_type=entry["content_type"], headers=response_headers)
+        # FileResponse sends only the headers for HEAD requests by itself.
+        return FileResponse(variant.path, media_type=entry["content_type"], headers=response_headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write .br/.gz variants of large files in a static build.")
+    parser.add_argument("build_dir", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "build"))
+    parser.add_argument("--min-bytes", type=int, default=STATIC_MEMORY_MAX_FILE_BYTES,
+                        help="Smallest file to precompress (smaller files are compressed in memory when served).")
+    args = parser.parse_args()
+    if brotli is None:
+        print("`brotli` is not installed; writing gzip variants only.")
+    print(f"Wrote {precompress(args.build_dir, args.min_bytes)} precompressed files in {args.build_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auth import User, create_session_token, verify_session_token
+
+
+def make_user():
+    return User(id=7, email="student@example.com", background="software")
+
+
+def test_round_trip():
+    claims = verify_session_token(create_session_token(make_user()))
+    assert claims["sub"] == 7
+    assert claims["email"] == "student@example.com"
+    assert claims["background"] == "software"
+
+
+def test_tampered_token_is_rejected():
+    payload, signature = create_session_token(make_user()).split(".")
+    other_payload, _ = create_session_token(User(id=8, email="other@example.com", background="")).split(".")
+    assert verify_session_token(f"{other_payload}.{signature}") is None
+    assert verify_session_token(f"{payload}.{signature[:-2]}xx") is None
+
+
+def test_expired_token_is_rejected():
+    assert verify_session_token(create_session_token(make_user(), ttl_s=-1)) is None
+
+
+def test_garbage_tokens_are_rejected():
+    for token in ["", ".", "abc", "abc.", ".abc", "abc.\xe9", "\xe9.abc", "\udcff.abc", "a.b.c", "!!!.???"]:
+        assert verify_session_token(token) is None
+
+
+def test_validly_signed_non_dict_claims_are_rejected():
+    from auth import _b64encode, _sign
+
+    for claims in [b"[1, 2]", b'"text"', b"null", b'{"exp": "never"}', b"not json"]:
+        payload = _b64encode(claims).encode("ascii")
+        assert verify_session_token(f"{payload.decode()}.{_sign(payload).decode()}") is None
+
+
+def test_fresh_token_is_not_expired():
+    claims = verify_session_token(create_session_token(make_user(), ttl_s=60))
+    assert time.time() < claims["exp"] <= time.time() + 60